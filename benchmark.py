@@ -0,0 +1,731 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+from config import (
+    ENCODING_CACHE_DIR,
+    KNOWN_FACES_DIR,
+    FACE_MATCH_THRESHOLD,
+    FRAME_RESIZE_SCALE,
+    PROTOTYPES_PER_PERSON,
+    PROTOTYPE_RERANK_MARGIN,
+    IVF_NLIST,
+    IVF_NPROBE,
+    IVF_TRAIN_ITERATIONS,
+    SQ8_RERANK_FACTOR
+)
+from face_utils import (
+    EncodingCache,
+    FlatIndex,
+    IVFIndex,
+    SQ8Index,
+    Gallery,
+    detect_and_encode
+)
+from pipeline_utils import RecognitionPipeline
+from db_utils import init_db, AttendanceWriter
+from metrics_utils import metrics
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+
+# ===================== TEST DATA =====================
+
+def synthetic_gallery(people, samples, seed=0, spread=0.02):
+    """
+    Generate clustered 128-d encodings that mimic face_recognition output:
+    about 0.3 between samples of one person (spread=0.02), about 0.9
+    between people.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 0.056, size=(people, 128))
+    noise = rng.normal(0, spread, size=(people, samples, 128))
+
+    encodings = (centers[:, None, :] + noise).reshape(-1, 128)
+    labels = np.repeat(np.arange(people), samples)
+    return encodings.astype(np.float32), labels
+
+
+def cached_gallery(cache_dir):
+    """
+    Use the real encodings stored by the encoding cache.
+    """
+    matrix, row_names = EncodingCache(cache_dir).read()
+    if len(matrix) == 0:
+        raise SystemExit(f"[ERROR] No cached encodings found in {cache_dir}")
+
+    lookup = {name: i for i, name in enumerate(sorted(set(row_names)))}
+    labels = np.array([lookup[name] for name in row_names])
+
+    return np.asarray(matrix, dtype=np.float32), labels
+
+
+def make_queries(encodings, count, seed=1):
+    """
+    Perturbed copies of random gallery samples.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(len(encodings), size=count)
+    noise = rng.normal(0, 0.02, size=(count, 128))
+    return (encodings[picks] + noise).astype(np.float32)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+# ===================== INDEX BENCHMARK =====================
+
+def time_search(index, queries, batch):
+    """
+    Run all queries in batches; return top-1 ids and per-batch latencies.
+    """
+    found = []
+    latencies = []
+
+    for start in range(0, len(queries), batch):
+        t0 = time.perf_counter()
+        _, ids = index.search(queries[start:start + batch], k=1)
+        latencies.append(time.perf_counter() - t0)
+        found.append(ids[:, 0])
+
+    return np.concatenate(found), latencies
+
+
+def benchmark_index(args):
+    if args.from_cache:
+        encodings, labels = cached_gallery(args.cache_dir)
+    else:
+        encodings, labels = synthetic_gallery(args.people, args.samples)
+
+    ids = np.arange(len(encodings))
+    queries = make_queries(encodings, args.queries)
+
+    exact = FlatIndex()
+    t0 = time.perf_counter()
+    exact.build(encodings, ids)
+    exact_build = time.perf_counter() - t0
+
+    approx = IVFIndex(args.nlist, args.nprobe, args.iterations)
+    t0 = time.perf_counter()
+    approx.build(encodings, ids)
+    approx_build = time.perf_counter() - t0
+
+    exact_ids, exact_lat = time_search(exact, queries, args.batch)
+    approx_ids, approx_lat = time_search(approx, queries, args.batch)
+
+    report = {
+        "gallery_size": len(encodings),
+        "identities": int(len(np.unique(labels))),
+        "queries": len(queries),
+        "batch": args.batch,
+        "nlist": args.nlist,
+        "nprobe": args.nprobe,
+        # Same nearest sample as the exact scan
+        "recall_at_1": float(np.mean(approx_ids == exact_ids)),
+        # Same nearest person as the exact scan
+        "identity_recall_at_1": float(
+            np.mean(labels[approx_ids] == labels[exact_ids])
+        ),
+        "flat": {
+            "build_s": exact_build,
+            "p50_ms": percentile_ms(exact_lat, 50),
+            "p95_ms": percentile_ms(exact_lat, 95),
+        },
+        "ivf": {
+            "build_s": approx_build,
+            "p50_ms": percentile_ms(approx_lat, 50),
+            "p95_ms": percentile_ms(approx_lat, 95),
+        },
+    }
+
+    print(
+        f"[INFO] gallery={report['gallery_size']} "
+        f"identities={report['identities']} queries={report['queries']}"
+    )
+    print(
+        f"[INFO] recall@1={report['recall_at_1']:.4f} "
+        f"identity recall@1={report['identity_recall_at_1']:.4f}"
+    )
+    for name in ("flat", "ivf"):
+        stats = report[name]
+        print(
+            f"[INFO] {name:<4} build {stats['build_s']:.2f}s | "
+            f"batch p50 {stats['p50_ms']:.2f} ms | "
+            f"p95 {stats['p95_ms']:.2f} ms"
+        )
+
+    return report
+
+
+# ===================== PROTOTYPE BENCHMARK =====================
+
+def gallery_bytes(gallery):
+    """
+    Memory held by the indexed rows plus any samples kept for re-ranking.
+    """
+    total = gallery.index.nbytes()
+    if gallery.samples is not None:
+        total += sum(s.nbytes for s in gallery.samples.values())
+    return total
+
+
+def benchmark_prototypes(args):
+    rng = np.random.default_rng(2)
+
+    # Held-out samples of known people act as probe faces
+    encodings, labels = synthetic_gallery(
+        args.people, args.samples + args.probes, spread=args.spread
+    )
+    per_person = args.samples + args.probes
+    held_out = (np.arange(len(encodings)) % per_person) >= args.samples
+
+    gallery_enc = encodings[~held_out].copy()
+    gallery_names = [f"person_{l}" for l in labels[~held_out]]
+
+    # Simulate badly cropped registration samples
+    outliers = rng.random(len(gallery_enc)) < args.outlier_rate
+    gallery_enc[outliers] += rng.normal(
+        0, 0.06, size=(outliers.sum(), 128)
+    ).astype(np.float32)
+
+    # Faces of people who were never registered
+    impostors, _ = synthetic_gallery(args.impostors, 1, seed=3)
+
+    probes = np.concatenate([encodings[held_out], impostors])
+    truth = [f"person_{l}" for l in labels[held_out]]
+    truth += [None] * len(impostors)
+
+    modes = {
+        "samples": dict(mode="samples"),
+        "prototypes": dict(mode="prototypes", rerank_margin=0),
+        "prototypes_rerank": dict(
+            mode="prototypes", rerank_margin=args.rerank_margin
+        ),
+    }
+
+    report = {
+        "people": args.people,
+        "samples_per_person": args.samples,
+        "probes": len(probes),
+        "prototypes_per_person": PROTOTYPES_PER_PERSON,
+        "threshold": args.threshold,
+    }
+
+    for label, options in modes.items():
+        gallery = Gallery(gallery_enc, gallery_names, **options)
+
+        predicted = []
+        latencies = []
+        for start in range(0, len(probes), args.batch):
+            t0 = time.perf_counter()
+            matches = gallery.match(
+                probes[start:start + args.batch], args.threshold
+            )
+            latencies.append(time.perf_counter() - t0)
+            predicted += [name for name, _, _ in matches]
+
+        correct = sum(p == t for p, t in zip(predicted, truth))
+        false_accepts = sum(
+            p is not None and p != t for p, t in zip(predicted, truth)
+        )
+        report[label] = {
+            "rows": len(gallery),
+            "bytes": gallery_bytes(gallery),
+            "accuracy": correct / len(truth),
+            "false_accepts": false_accepts,
+            "p50_ms": percentile_ms(latencies, 50),
+            "p95_ms": percentile_ms(latencies, 95),
+        }
+
+        stats = report[label]
+        print(
+            f"[INFO] {label:<17} rows {stats['rows']:>7} | "
+            f"{stats['bytes'] / 1e6:8.2f} MB | "
+            f"accuracy {stats['accuracy']:.4f} | "
+            f"false accepts {stats['false_accepts']} | "
+            f"batch p50 {stats['p50_ms']:.2f} ms"
+        )
+
+    return report
+
+
+# ===================== STORAGE BENCHMARK =====================
+
+def scan_bytes(index):
+    """
+    Memory read by a full scan (a quantized index re-ranks only a few
+    of its float vectors).
+    """
+    if isinstance(index, SQ8Index) and index.vectors is not None:
+        return index.nbytes() - index.vectors.nbytes
+    return index.nbytes()
+
+
+def benchmark_storage(args):
+    rng = np.random.default_rng(2)
+
+    if args.from_cache:
+        encodings, labels = cached_gallery(args.cache_dir)
+        gallery_enc, gallery_labels = encodings, labels
+        probes = make_queries(encodings, args.queries)
+        truth = [None] * len(probes)
+    else:
+        # Held-out samples of known people plus never-registered faces
+        per_person = args.samples + 1
+        encodings, labels = synthetic_gallery(
+            args.people, per_person, spread=args.spread
+        )
+        held_out = (np.arange(len(encodings)) % per_person) == args.samples
+        gallery_enc = encodings[~held_out]
+        gallery_labels = labels[~held_out]
+
+        picks = rng.choice(args.people, min(args.queries, args.people),
+                           replace=False)
+        impostors, _ = synthetic_gallery(args.impostors, 1, seed=3)
+        probes = np.concatenate([encodings[held_out][picks], impostors])
+        truth = [f"person_{l}" for l in picks] + [None] * len(impostors)
+
+    names = [f"person_{l}" for l in gallery_labels]
+    ids = np.arange(len(gallery_enc))
+
+    # What load_known_faces used to hold: one float64 array per sample
+    rows64 = [np.array(row, dtype=np.float64) for row in gallery_enc]
+    list_bytes = sum(sys.getsizeof(row) for row in rows64) + sys.getsizeof(
+        rows64
+    )
+
+    variants = {
+        "float32": FlatIndex(),
+        "sq8": SQ8Index(rerank_factor=0),
+        "sq8_rerank": SQ8Index(rerank_factor=args.rerank_factor),
+    }
+
+    report = {
+        "gallery_size": len(gallery_enc),
+        "probes": len(probes),
+        "threshold": args.threshold,
+        "float64_list": {
+            "bytes": list_bytes,
+            "bytes_per_sample": list_bytes / len(gallery_enc),
+        },
+    }
+    print(
+        f"[INFO] gallery={len(gallery_enc)} probes={len(probes)} | "
+        f"float64 list {list_bytes / 1e6:.2f} MB "
+        f"({list_bytes / len(gallery_enc):.0f} B/sample)"
+    )
+
+    reference = None
+    for label, index in variants.items():
+        index.build(gallery_enc, ids)
+        gallery = Gallery(gallery_enc, names, index=index, mode="samples")
+
+        found = []
+        distances = []
+        predicted = []
+        latencies = []
+        for start in range(0, len(probes), args.batch):
+            batch = probes[start:start + args.batch]
+            t0 = time.perf_counter()
+            matches = gallery.match(batch, args.threshold)
+            latencies.append(time.perf_counter() - t0)
+
+            d, i = index.search(batch, k=1)
+            found.append(i[:, 0])
+            distances.append(d[:, 0])
+            predicted += [name for name, _, _ in matches]
+
+        found = np.concatenate(found)
+        distances = np.concatenate(distances)
+        if reference is None:
+            # The float32 exact scan is the reference for the others
+            reference = (found, distances)
+
+        total = index.nbytes()
+        scanned = scan_bytes(index)
+        stats = {
+            "bytes": total,
+            "scan_bytes": scanned,
+            "bytes_per_sample": total / len(gallery_enc),
+            # Same nearest sample as the exact float32 scan
+            "recall_at_1": float(np.mean(found == reference[0])),
+            "max_distance_error": float(
+                np.max(np.abs(distances - reference[1]))
+            ),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p95_ms": percentile_ms(latencies, 95),
+        }
+        if any(t is not None for t in truth):
+            stats["accuracy"] = sum(
+                p == t for p, t in zip(predicted, truth)
+            ) / len(truth)
+            stats["false_accepts"] = sum(
+                p is not None and p != t for p, t in zip(predicted, truth)
+            )
+        report[label] = stats
+
+        line = (
+            f"[INFO] {label:<10} {total / 1e6:8.2f} MB "
+            f"({stats['bytes_per_sample']:.0f} B/sample, scan "
+            f"{scanned / 1e6:.2f} MB) | recall@1 {stats['recall_at_1']:.4f} "
+            f"| max dist error {stats['max_distance_error']:.4f}"
+        )
+        if "accuracy" in stats:
+            line += (
+                f" | accuracy {stats['accuracy']:.4f} "
+                f"| false accepts {stats['false_accepts']}"
+            )
+        print(line + f" | batch p50 {stats['p50_ms']:.2f} ms")
+
+    return report
+
+
+# ===================== PIPELINE BENCHMARK =====================
+
+def replay_frames(source, max_frames=None):
+    """
+    Yield (key, BGR frame) from a video file or a directory of images.
+    Keys are frame numbers (as strings) for videos, file names for images.
+    """
+    if os.path.isdir(source):
+        names = sorted(os.listdir(source))[:max_frames]
+        for name in names:
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                yield name, frame
+        return
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise SystemExit(f"[ERROR] Unable to open {source}")
+
+    index = 0
+    while max_frames is None or index < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield str(index), frame
+        index += 1
+    cap.release()
+
+
+def load_truth(path):
+    """
+    Ground truth as {frame key: set of known names in that frame}.
+    The file is a JSON object such as {"0": ["alice"], "12": []};
+    frames it doesn't list are not scored.
+    """
+    with open(path) as f:
+        return {str(key): set(names) for key, names in json.load(f).items()}
+
+
+def stage_stats(samples):
+    return {
+        "mean_ms": float(np.mean(samples) * 1000) if samples else 0.0,
+        "p50_ms": percentile_ms(samples, 50),
+        "p95_ms": percentile_ms(samples, 95),
+        "p99_ms": percentile_ms(samples, 99),
+    }
+
+
+def metric_totals():
+    """
+    Seconds observed per timer and running value per counter in the
+    shared metrics registry, summed over labels.
+    """
+    timers = {}
+    counters = {}
+    with metrics.lock:
+        for (name, _), timer in metrics.timers.items():
+            timers[name] = timers.get(name, 0.0) + timer.total
+        for (name, _), value in metrics.counters.items():
+            counters[name] = counters.get(name, 0) + value
+    return timers, counters
+
+
+# Stages RecognitionPipeline.process observes on the calling thread
+PIPELINE_STAGES = ("match", "track")
+
+# Camera name of the replayed source
+REPLAY_CAMERA = "replay"
+
+
+def benchmark_pipeline(args):
+    """
+    Replay recorded frames through detection and encoding, then
+    RecognitionPipeline.process (matching, face tracks, the person
+    tracker and the attendance writer), one frame at a time.
+    Stage times are read from the pipeline's own metrics.
+    """
+    # The configured cache belongs to the configured gallery; any other
+    # gallery gets a throwaway cache so the real one is never rewritten
+    cache_dir = args.cache_dir
+    scratch_cache = None
+    if cache_dir is None:
+        if os.path.abspath(args.known_dir) == os.path.abspath(KNOWN_FACES_DIR):
+            cache_dir = ENCODING_CACHE_DIR
+        else:
+            scratch_cache = cache_dir = tempfile.mkdtemp(
+                prefix="ipmas_bench_cache_"
+            )
+
+    gallery = Gallery.load(args.known_dir, cache_dir)
+    truth = load_truth(args.truth) if args.truth else None
+
+    db_dir = None
+    db_path = args.db
+    if db_path is None:
+        db_dir = tempfile.mkdtemp(prefix="ipmas_bench_")
+        db_path = os.path.join(db_dir, "attendance.db")
+    init_db(db_path)
+    writer = AttendanceWriter(db_path)
+
+    pipeline = RecognitionPipeline(gallery, writer, threshold=args.threshold)
+    tracks = pipeline.tracks_for(REPLAY_CAMERA)
+
+    stages = {}
+    frames = faces = 0
+    tp = missed = false_accepts = scored = 0
+
+    start_timers, start_counters = metric_totals()
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+
+    for key, frame in replay_frames(args.source, args.max_frames):
+        timings = {}
+        before, _ = metric_totals()
+        frame_start = time.perf_counter()
+
+        boxes, encodings = detect_and_encode(
+            frame, scale=args.scale,
+            skip_boxes=pipeline.skip_boxes(REPLAY_CAMERA), timings=timings
+        )
+        # Recorded like the stage times workers send back
+        for stage, seconds in timings.items():
+            metrics.observe(stage, seconds)
+
+        processed_at = time.monotonic()
+        t0 = time.perf_counter()
+        pipeline.process(frame, boxes, encodings, REPLAY_CAMERA)
+        finished = time.perf_counter()
+
+        after, _ = metric_totals()
+        for stage in PIPELINE_STAGES:
+            timings[stage] = after.get(stage, 0.0) - before.get(stage, 0.0)
+        timings["process"] = finished - t0
+        timings["total"] = finished - frame_start
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+
+        frames += 1
+        faces += len(boxes)
+
+        if truth is not None and key in truth:
+            # Identities the pipeline gave the faces of this frame
+            with tracks.lock:
+                known = {
+                    t.name for t in tracks.tracks.values()
+                    if t.last_detected >= processed_at and t.name
+                    and not t.name.startswith("UNKNOWN")
+                }
+            tp += len(known & truth[key])
+            missed += len(truth[key] - known)
+            false_accepts += len(known - truth[key])
+            scored += 1
+
+    # Whatever the writer still holds is part of the run
+    t0 = time.perf_counter()
+    writer.close()
+    flush_s = time.perf_counter() - t0
+    elapsed = time.perf_counter() - started
+
+    # Batches committed by the writer thread during the run
+    end_timers, end_counters = metric_totals()
+    events = end_counters.get("db_events", 0) - start_counters.get(
+        "db_events", 0
+    )
+
+    report = {
+        "source": args.source,
+        "scale": args.scale,
+        "gallery_size": len(gallery),
+        "frames": frames,
+        "faces": faces,
+        "db_events": events,
+        "elapsed_s": elapsed,
+        "frames_per_s": frames / elapsed if elapsed else 0.0,
+        "faces_per_s": faces / elapsed if elapsed else 0.0,
+        "db_flush_s": flush_s,
+        "db_write_s": (
+            end_timers.get("db_write", 0.0) - start_timers.get("db_write", 0.0)
+        ),
+        "stages": {stage: stage_stats(v) for stage, v in stages.items()},
+    }
+
+    if args.trace_memory:
+        report["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        report["peak_rss_mb"] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        )
+
+    if truth is not None:
+        report["accuracy"] = {
+            "frames_scored": scored,
+            "identified": tp,
+            "missed": missed,
+            "false_accepts": false_accepts,
+            "recall": tp / (tp + missed) if tp + missed else 0.0,
+            "precision": (
+                tp / (tp + false_accepts) if tp + false_accepts else 0.0
+            ),
+        }
+
+    if db_dir is not None:
+        for name in os.listdir(db_dir):
+            os.remove(os.path.join(db_dir, name))
+        os.rmdir(db_dir)
+    if scratch_cache is not None:
+        shutil.rmtree(scratch_cache, ignore_errors=True)
+
+    print(
+        f"[INFO] {frames} frames, {faces} faces in {elapsed:.2f}s | "
+        f"{report['frames_per_s']:.1f} frames/s"
+    )
+    for stage, stats in report["stages"].items():
+        print(
+            f"[INFO] {stage:<8} p50 {stats['p50_ms']:7.2f} ms | "
+            f"p95 {stats['p95_ms']:7.2f} ms | p99 {stats['p99_ms']:7.2f} ms"
+        )
+    if "peak_rss_mb" in report:
+        print(f"[INFO] peak RSS {report['peak_rss_mb']:.1f} MB")
+    if truth is not None:
+        acc = report["accuracy"]
+        print(
+            f"[INFO] recall {acc['recall']:.4f} | "
+            f"precision {acc['precision']:.4f} | "
+            f"false accepts {acc['false_accepts']}"
+        )
+
+    return report
+
+
+# ===================== COMMAND LINE =====================
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks for the IPMAS recognition pipeline"
+    )
+    parser.add_argument(
+        "--json", help="Write the report to this file as JSON"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser(
+        "index", help="Recall and latency of the IVF index vs exact scan"
+    )
+    index.add_argument("--people", type=int, default=20000)
+    index.add_argument("--samples", type=int, default=15)
+    index.add_argument("--queries", type=int, default=1000)
+    index.add_argument("--batch", type=int, default=10,
+                       help="Faces matched per search call")
+    index.add_argument("--nlist", type=int, default=IVF_NLIST)
+    index.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    index.add_argument("--iterations", type=int,
+                       default=IVF_TRAIN_ITERATIONS)
+    index.add_argument("--from-cache", action="store_true",
+                       help="Use the cached known face encodings")
+    index.add_argument("--cache-dir", default=ENCODING_CACHE_DIR)
+    index.set_defaults(run=benchmark_index)
+
+    prototypes = commands.add_parser(
+        "prototypes",
+        help="Accuracy, memory and latency of prototype vs sample galleries"
+    )
+    prototypes.add_argument("--people", type=int, default=2000)
+    prototypes.add_argument("--samples", type=int, default=15)
+    prototypes.add_argument("--probes", type=int, default=2,
+                            help="Held-out faces per person")
+    prototypes.add_argument("--impostors", type=int, default=1000)
+    prototypes.add_argument("--spread", type=float, default=0.025,
+                            help="Per-person noise of the synthetic faces")
+    prototypes.add_argument("--outlier-rate", type=float, default=0.05)
+    prototypes.add_argument("--batch", type=int, default=10)
+    prototypes.add_argument("--threshold", type=float,
+                            default=FACE_MATCH_THRESHOLD)
+    prototypes.add_argument("--rerank-margin", type=float,
+                            default=PROTOTYPE_RERANK_MARGIN or 0.05)
+    prototypes.set_defaults(run=benchmark_prototypes)
+
+    storage = commands.add_parser(
+        "storage",
+        help="Accuracy vs memory of float32 and 8-bit quantized galleries"
+    )
+    storage.add_argument("--people", type=int, default=20000)
+    storage.add_argument("--samples", type=int, default=15)
+    storage.add_argument("--queries", type=int, default=1000)
+    storage.add_argument("--impostors", type=int, default=1000)
+    storage.add_argument("--spread", type=float, default=0.025,
+                         help="Per-person noise of the synthetic faces")
+    storage.add_argument("--batch", type=int, default=10)
+    storage.add_argument("--threshold", type=float,
+                         default=FACE_MATCH_THRESHOLD)
+    storage.add_argument("--rerank-factor", type=int,
+                         default=SQ8_RERANK_FACTOR or 4)
+    storage.add_argument("--from-cache", action="store_true",
+                         help="Use the cached known face encodings")
+    storage.add_argument("--cache-dir", default=ENCODING_CACHE_DIR)
+    storage.set_defaults(run=benchmark_storage)
+
+    pipeline = commands.add_parser(
+        "pipeline",
+        help="Replay a video or image folder through the full recognizer"
+    )
+    pipeline.add_argument("source", help="Video file or image directory")
+    pipeline.add_argument("--truth",
+                          help="JSON file of known names per frame key")
+    pipeline.add_argument("--known-dir", default=KNOWN_FACES_DIR)
+    pipeline.add_argument("--cache-dir",
+                          help="Encoding cache of --known-dir (default: "
+                               "the configured one for the configured "
+                               "folder, otherwise a temporary one)")
+    pipeline.add_argument("--db",
+                          help="Attendance database to write "
+                               "(default: a temporary one)")
+    pipeline.add_argument("--scale", type=float, default=FRAME_RESIZE_SCALE)
+    pipeline.add_argument("--threshold", type=float,
+                          default=FACE_MATCH_THRESHOLD)
+    pipeline.add_argument("--max-frames", type=int)
+    pipeline.add_argument("--trace-memory", action="store_true",
+                          help="Also report peak Python heap (slower)")
+    pipeline.set_defaults(run=benchmark_pipeline)
+
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    report = args.run(args)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
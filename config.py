@@ -3,25 +3,191 @@
 # Camera index or IP camera stream URL
 VIDEO_SOURCE = 0  # "http://10.144.224.143:8000/video"
 
+# Named cameras, e.g. one per door. All share one gallery and recognizer,
+# and attendance rows record which camera saw each entry and exit.
+VIDEO_SOURCES = {
+    "main": VIDEO_SOURCE,
+    # "entrance": "http://10.144.224.143:8000/video",
+    # "exit": "http://10.144.224.144:8000/video",
+}
+
+# Requested capture resolution
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
 # Frame scaling factor used during recognition
 # Lower values increase speed but reduce accuracy
 FRAME_RESIZE_SCALE = 0.25   # Avoid going lower than this
 
+# A live stream that stops delivering is reopened after this many
+# seconds; the wait doubles after each failed attempt, up to the maximum
+CAMERA_RECONNECT_DELAY = 1.0
+CAMERA_RECONNECT_MAX_DELAY = 30.0
+
+# A network stream that delivers nothing for this many seconds counts
+# as dropped (instead of blocking the capture thread indefinitely)
+CAMERA_READ_TIMEOUT = 5.0
+
 
 # ===================== PERFORMANCE TUNING =====================
 
-# Run face recognition once every N frames
-FRAME_SKIP = 8   # Balanced for smooth display and stable recognition
+# While something is happening, offer a frame for recognition at most
+# once every N frames (frames are dropped anyway while all recognition
+# workers are busy); the adaptive scheduler raises this over budget
+FRAME_SKIP = 2
+
+# Worker processes running face detection and encoding
+# 0 = one per CPU core, leaving one core for capture and display
+RECOGNITION_WORKERS = 0
+
+# Frames that may be queued or in progress per worker
+RECOGNITION_FRAMES_PER_WORKER = 2
+
+# A frame without a result after this many seconds is given up on
+# (e.g. its worker crashed) so later frames aren't held back
+RECOGNITION_RESULT_TIMEOUT = 10.0
+
+# Preallocated frames shared by capture, display and recognition
+# 0 = just enough for every frame that can be in flight
+FRAME_RING_SLOTS = 0
+
+# Frames older than this many seconds (since capture) are never sent
+# for recognition, which keeps camera-to-attendance latency bounded
+MAX_FRAME_AGE = 1.0
 
 # Face match sensitivity (lower = stricter matching)
 FACE_MATCH_THRESHOLD = 0.45
 
 
+# ===================== ADAPTIVE SCHEDULING =====================
+
+# Motion is detected on a grey copy of each frame this many pixels wide
+MOTION_WIDTH = 80
+
+# A pixel counts as changed when its grey level moves by more than this
+MOTION_PIXEL_DELTA = 25
+
+# Fraction of changed pixels that counts as motion
+MOTION_MIN_AREA = 0.005
+
+# A camera stays "active" this long after its last motion
+MOTION_HOLD_SECONDS = 1.0
+
+# With no motion and no tracked faces, recognize only this often
+# (still catches people standing still, and lets exits time out)
+IDLE_RECOGNITION_SECONDS = 2.0
+
+# Scale used while a camera is active and the budget allows it:
+# finds smaller, more distant faces than FRAME_RESIZE_SCALE
+ACTIVE_RESIZE_SCALE = 0.5
+
+# Share of the recognition workers' time the scheduler aims to use;
+# above it, resolution and then frame rate are lowered
+RECOGNITION_CPU_BUDGET = 0.75
+
+
+# ===================== DETECTION REGIONS =====================
+
+# Look for faces only around motion and existing tracks, instead of
+# scanning the whole frame on every pass
+ROI_DETECTION = True
+
+# Scale used inside those regions; higher than the full-frame scale so
+# small, distant faces are still found. Lowered automatically so the
+# regions never cost more than a full-frame pass would.
+ROI_RESIZE_SCALE = 1.0
+
+# Track boxes are grown by this fraction of their size on every side
+ROI_TRACK_PADDING = 0.5
+
+# Motion boxes are grown by this fraction (a moving body may show
+# its face at the edge of the changed area)
+ROI_MOTION_PADDING = 0.25
+
+# Regions smaller than this (pixels) are grown to it
+ROI_MIN_SIZE = 96
+
+# Scan the whole frame at least this often to catch new arrivals
+ROI_FULL_SWEEP_SECONDS = 1.0
+
+
+# ===================== GALLERY INDEX =====================
+
+# "flat" = exact scan over every sample
+# "ivf"  = approximate inverted-file index for large galleries
+# "sq8"  = scan 8-bit quantized samples (4x smaller than float32),
+#          then re-check the closest ones exactly
+INDEX_BACKEND = "flat"
+
+# Number of coarse clusters in the IVF index (about sqrt of gallery size)
+IVF_NLIST = 64
+
+# Clusters searched per face: higher = better recall, slower search
+IVF_NPROBE = 8
+
+# k-means iterations used to train the IVF clusters
+IVF_TRAIN_ITERATIONS = 10
+
+# Nearest samples fetched per face when computing the match margin
+MATCH_TOP_K = 16
+
+# Quantized candidates re-checked exactly per requested neighbour in the
+# "sq8" index (0 = return approximate distances, keep no float copy)
+SQ8_RERANK_FACTOR = 4
+
+
+# ===================== GALLERY COMPRESSION =====================
+
+# "samples"    = match against every stored sample
+# "prototypes" = reduce each person's samples to a few representative vectors
+GALLERY_MODE = "samples"
+
+# Representative vectors per person (1 = mean, more = k-medoids)
+PROTOTYPES_PER_PERSON = 1
+
+# Samples farther than this from the person's median are treated as outliers
+PROTOTYPE_OUTLIER_DISTANCE = 0.5
+
+# Re-check close calls against every sample of the top candidates (0 = off)
+PROTOTYPE_RERANK_MARGIN = 0.05
+
+# Number of candidate people compared during a re-check
+PROTOTYPE_RERANK_CANDIDATES = 3
+
+
 # ===================== TRACKING / EXIT LOGIC =====================
 
 # Time (in seconds) before a person is considered to have exited
 EXIT_TIMEOUT_SECONDS = 5
 
+# Maximum unknown faces remembered at once (least recently seen are evicted)
+UNKNOWN_CAPACITY = 1000
+
+# Forget an unknown face after this many seconds without a sighting
+UNKNOWN_TTL_SECONDS = 3600
+
+# Unknown IDs whose faces are closer than this are merged into one (0 = off)
+UNKNOWN_MERGE_DISTANCE = 0.35
+
+
+# ===================== FACE TRACKS =====================
+
+# Minimum box overlap (IoU) for a detection to continue an existing track
+TRACK_IOU_THRESHOLD = 0.3
+
+# Recognition passes a track may go undetected before it is dropped
+TRACK_MAX_MISSES = 3
+
+# Re-encode a tracked face at least this often (seconds)
+TRACK_REENCODE_SECONDS = 2.0
+
+# Re-encode sooner when the last match margin was below this
+TRACK_MIN_MARGIN = 0.1
+
+# Move boxes between recognitions with OpenCV KCF trackers
+# (needs opencv-contrib; otherwise boxes follow their recent motion)
+TRACK_USE_OPENCV = False
+
 
 # ===================== FILE PATHS =====================
 
@@ -29,9 +195,98 @@ KNOWN_FACES_DIR = "data/known_faces"
 UNKNOWN_FACES_DIR = "data/unknown_faces"
 INTRUDER_SNAPSHOTS_DIR = "data/intruders"
 
+# On-disk store of known face encodings (skips re-encoding unchanged images)
+ENCODING_CACHE_DIR = "data/encoding_cache"
+
 DATABASE_PATH = "data/attendance.db"
 
 
+# ===================== BULK ENROLLMENT =====================
+
+# Processes running face detection and encoding in enroll.py
+# 0 = one per CPU core
+ENROLL_WORKERS = 0
+
+# Threads reading and decoding image files
+ENROLL_DECODE_THREADS = 4
+
+# Larger photos are shrunk to this many pixels on their longest side
+# before detection (HOG time grows with the pixel count)
+ENROLL_MAX_IMAGE_SIZE = 1024
+
+# Samples are rejected when the face is smaller than this (pixels) ...
+ENROLL_MIN_FACE_SIZE = 40
+
+# ... or blurrier than this (variance of the Laplacian of the face)
+ENROLL_MIN_SHARPNESS = 40.0
+
+
+# ===================== LIVE REGISTRATION =====================
+
+# Samples collected from the live stream when registering with 'r'
+REGISTER_SAMPLES = 15
+
+# Give up after this many seconds; the person is still registered if
+# at least REGISTER_MIN_SAMPLES were collected by then
+REGISTER_TIMEOUT_SECONDS = 60
+REGISTER_MIN_SAMPLES = 5
+
+# Samples are at least this many seconds apart ...
+REGISTER_SAMPLE_INTERVAL = 0.3
+
+# ... and this far (encoding distance) from every sample kept so far,
+# so the person has to turn or move a little between samples.
+# Blurry or tiny faces are rejected with the ENROLL_* limits above.
+REGISTER_MIN_SAMPLE_DISTANCE = 0.05
+
+
+# ===================== DATABASE WRITES =====================
+
+# Attendance events are committed in groups by a background writer:
+# whichever comes first of this many events ...
+DB_BATCH_SIZE = 100
+
+# ... or this many seconds after the first pending event
+DB_FLUSH_INTERVAL = 0.5
+
+# Person ids the writer remembers (most recently used); unknown
+# visitors each get a name, so this must not grow without limit
+DB_PERSON_ID_CACHE = 4096
+
+
+# ===================== INTRUDER SNAPSHOTS =====================
+
+# Image format of saved face crops ("jpg", "png" or "webp")
+SNAPSHOT_FORMAT = "jpg"
+
+# JPEG/WebP quality, 0-100
+SNAPSHOT_QUALITY = 90
+
+# Crops waiting to be written; when full, SNAPSHOT_DROP_POLICY decides
+# whether the "newest" (incoming) or "oldest" (waiting) crop is lost
+SNAPSHOT_QUEUE_SIZE = 64
+SNAPSHOT_DROP_POLICY = "newest"
+
+# Which crop of a new unknown face to keep: "first" saves the first one
+# immediately; "sharpest" or "largest" pick the best crop seen within
+# SNAPSHOT_SELECT_WINDOW seconds of the first sighting
+SNAPSHOT_SELECT = "sharpest"
+SNAPSHOT_SELECT_WINDOW = 2.0
+
+
+# ===================== METRICS =====================
+
+# Serve stage timings, counters and queue depths for Prometheus at
+# http://127.0.0.1:<port>/metrics (0 = off)
+METRICS_PORT = 0
+
+# Also append a JSON snapshot of them to this file (None = off) ...
+METRICS_LOG_PATH = None
+
+# ... every this many seconds
+METRICS_LOG_INTERVAL = 10
+
+
 # ===================== RUNTIME BEHAVIOR =====================
 
 # Whether to flag and store unknown faces
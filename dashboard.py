@@ -1,11 +1,109 @@
 import tkinter as tk
 from tkinter import ttk
+import queue
 import sqlite3
-import pandas as pd
+import threading
 from datetime import datetime
 from config import DATABASE_PATH
 
 
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_time(value):
+    try:
+        return datetime.fromisoformat(value).strftime(TIME_FORMAT)
+    except (TypeError, ValueError):
+        return value or ""
+
+
+# ===================== PER-PERSON ROWS =====================
+
+def summary_values(row):
+    """
+    Treeview values for one person_summary row. Time outside is the
+    sum of the gaps between an exit and the next entry.
+    """
+    (person, first_entry, last_entry, exit_count, total_outside,
+     final_exit, open_sessions) = row
+
+    final_exit_str = format_time(final_exit) if final_exit else "Still inside"
+    current_status = "Inside" if open_sessions else "Outside"
+
+    return (
+        person,
+        format_time(first_entry),
+        exit_count,
+        f"{total_outside:.1f}s",
+        final_exit_str,
+        current_status
+    )
+
+
+# ===================== BACKGROUND READER =====================
+
+class AttendanceFeed:
+    """
+    Reads the per-person summaries changed since the last read on its
+    own thread, so the Tk main loop never waits on the database. Each
+    batch of rows is put on `updates` for the UI to apply.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.updates = queue.Queue()
+
+        # High-water mark: highest change_seq already delivered
+        self.since = 0
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        conn = None
+
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+
+            try:
+                if conn is None:
+                    conn = sqlite3.connect(self.db_path)
+
+                rows = conn.execute("""
+                    SELECT p.name, s.first_entry, s.last_entry,
+                           s.exit_count, s.total_outside, s.final_exit,
+                           s.open_sessions, s.change_seq
+                    FROM person_summary s JOIN persons p
+                        ON p.id = s.person_id
+                    WHERE s.change_seq > ?
+                    ORDER BY s.change_seq
+                """, (self.since,)).fetchall()
+            except sqlite3.Error as e:
+                print("[ERROR] Failed to load attendance data:", e)
+                continue
+
+            if rows:
+                self.since = rows[-1][-1]
+            self.updates.put(rows)
+
+        if conn is not None:
+            conn.close()
+
+
+# ===================== DASHBOARD WINDOW =====================
+
 class IPMASDashboard:
     def __init__(self, root):
         self.root = root
@@ -38,105 +136,53 @@ class IPMASDashboard:
         )
         refresh_btn.pack(pady=10)
 
+        # Latest summary row of every person, keyed by name
+        self.people = {}
+
+        self.feed = AttendanceFeed(DATABASE_PATH)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
         # --- Automatic refresh (every 5 seconds) ---
         self.refresh_interval_ms = 5000
+        self.poll_interval_ms = 200
         self.schedule_refresh()
+        self.poll_updates()
 
     def schedule_refresh(self):
         self.load_data()
         self.root.after(self.refresh_interval_ms, self.schedule_refresh)
 
     def load_data(self):
-        # Clear existing rows
-        for row in self.tree.get_children():
-            self.tree.delete(row)
-
-        conn = sqlite3.connect(DATABASE_PATH)
+        # The query runs on the feed thread; results arrive in poll_updates
+        self.feed.request()
 
+    def poll_updates(self):
         try:
-            df = pd.read_sql("SELECT * FROM attendance", conn)
-        except Exception as e:
-            print("[ERROR] Failed to load attendance data:", e)
-            conn.close()
-            return
-
-        if df.empty:
-            conn.close()
-            return
-
-        # Ensure expected columns are present
-        for col in [
-            "person_name",
-            "entry_time",
-            "exit_time",
-            "outside_duration",
-            "status"
-        ]:
-            if col not in df.columns:
-                df[col] = None
-
-        # Convert time columns safely
-        df["entry_time"] = pd.to_datetime(df["entry_time"], errors="coerce")
-        df["exit_time"] = pd.to_datetime(df["exit_time"], errors="coerce")
-
-        # Process data per person
-        grouped = df.groupby("person_name")
-
-        for person, group in grouped:
-            group = group.sort_values("entry_time")
-
-            # First recorded entry
-            first_entry = group["entry_time"].iloc[0].strftime(
-                "%Y-%m-%d %H:%M:%S"
-            )
-
-            # Number of completed exits
-            exit_count = group["exit_time"].notna().sum()
-
-            # Total time spent outside
-            total_outside = group["outside_duration"].fillna(0).sum()
-
-            # Most recent exit
-            final_exit = group["exit_time"].dropna().max()
-            final_exit_str = (
-                final_exit.strftime("%Y-%m-%d %H:%M:%S")
-                if pd.notna(final_exit)
-                else "Still inside"
-            )
-
-            # Determine current status
-            last_row = group.iloc[-1]
-
-            if pd.isna(last_row["exit_time"]):
-                current_status = "Inside"
-
-                # Live duration since last entry
-                live_duration = (
-                    datetime.now() - last_row["entry_time"]
-                ).total_seconds()
-
-                total_outside_str = (
-                    f"{total_outside:.1f}s + "
-                    f"{live_duration:.1f}s (ongoing)"
-                )
+            while True:
+                self.apply_rows(self.feed.updates.get_nowait())
+        except queue.Empty:
+            pass
+        self.root.after(self.poll_interval_ms, self.poll_updates)
+
+    def apply_rows(self, rows):
+        """
+        Redraw only the people whose summary changed.
+        """
+        changed = set()
+        for row in rows:
+            self.people[row[0]] = row[:-1]
+            changed.add(row[0])
+
+        for person in changed:
+            values = summary_values(self.people[person])
+            if self.tree.exists(person):
+                self.tree.item(person, values=values)
             else:
-                current_status = "Outside"
-                total_outside_str = f"{total_outside:.1f}s"
-
-            self.tree.insert(
-                "",
-                tk.END,
-                values=(
-                    person,
-                    first_entry,
-                    exit_count,
-                    total_outside_str,
-                    final_exit_str,
-                    current_status
-                )
-            )
-
-        conn.close()
+                self.tree.insert("", tk.END, iid=person, values=values)
+
+    def close(self):
+        self.feed.stop()
+        self.root.destroy()
 
 
 if __name__ == "__main__":
@@ -1,71 +1,550 @@
+import argparse
+import queue
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 
+from metrics_utils import metrics
+from config import (
+    DATABASE_PATH,
+    DB_BATCH_SIZE,
+    DB_FLUSH_INTERVAL,
+    DB_PERSON_ID_CACHE
+)
 
-def init_db(db_path):
+
+# ===================== SCHEMA MIGRATIONS =====================
+
+def _columns(cursor, table):
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+
+
+def _migrate_v1(cursor):
     """
-    Set up the attendance database.
-    Any existing attendance table is removed to ensure
-    the schema is always in a known state.
+    Person ids instead of repeated names, plus indexes for the
+    open-session lookup and time range queries. Rows of the old
+    name-based table are carried over.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE persons (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    """)
 
-    # Remove old table if it exists to avoid schema conflicts
-    cursor.execute("DROP TABLE IF EXISTS attendance")
+    legacy = _columns(cursor, "attendance")
+    if legacy:
+        cursor.execute("ALTER TABLE attendance RENAME TO attendance_v0")
 
-    # Create the attendance table
     cursor.execute("""
         CREATE TABLE attendance (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            person_name TEXT NOT NULL,
+            person_id INTEGER NOT NULL REFERENCES persons(id),
             entry_time TEXT NOT NULL,
             exit_time TEXT,
             outside_duration REAL DEFAULT 0,
-            status TEXT DEFAULT 'Inside'
+            status TEXT DEFAULT 'Inside',
+            entry_camera TEXT,
+            exit_camera TEXT
         )
     """)
 
-    conn.commit()
-    conn.close()
+    if legacy:
+        # Databases from before multi-camera support have no camera columns
+        cameras = [c for c in ("entry_camera", "exit_camera") if c in legacy]
+        copied = ["id", "entry_time", "exit_time", "outside_duration",
+                  "status"] + cameras
+
+        cursor.execute("""
+            INSERT INTO persons (name)
+            SELECT DISTINCT person_name FROM attendance_v0
+            WHERE person_name IS NOT NULL
+        """)
+        cursor.execute(f"""
+            INSERT INTO attendance (person_id, {", ".join(copied)})
+            SELECT p.id, {", ".join("a." + c for c in copied)}
+            FROM attendance_v0 a JOIN persons p ON p.name = a.person_name
+        """)
+        cursor.execute("DROP TABLE attendance_v0")
+
+    # update_exit only ever looks at a person's open session
+    cursor.execute("""
+        CREATE INDEX idx_attendance_open
+        ON attendance (person_id) WHERE exit_time IS NULL
+    """)
+    cursor.execute("""
+        CREATE INDEX idx_attendance_entry_time ON attendance (entry_time)
+    """)
 
 
-def create_session(db_path, person_name, entry_time):
+def _migrate_v2(cursor):
     """
-    Record a new entry event for a person.
+    Number every insert and update with an increasing change_seq,
+    so readers can fetch only the rows changed since their last look.
     """
-    # Basic validation to avoid empty names
-    if not person_name or str(person_name).strip() == "":
-        person_name = "Unknown"
+    cursor.execute("""
+        ALTER TABLE attendance
+        ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0
+    """)
+    cursor.execute("UPDATE attendance SET change_seq = id")
+    cursor.execute("""
+        CREATE INDEX idx_attendance_change_seq ON attendance (change_seq)
+    """)
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    # SQLite has a single writer, so MAX + 1 can't be handed out twice
+    next_seq = """
+        UPDATE attendance
+        SET change_seq = (SELECT MAX(change_seq) + 1 FROM attendance)
+        WHERE id = NEW.id;
+    """
+    cursor.execute(f"""
+        CREATE TRIGGER attendance_insert_seq AFTER INSERT ON attendance
+        BEGIN {next_seq} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER attendance_update_seq
+        AFTER UPDATE OF exit_time, outside_duration, status, exit_camera
+        ON attendance
+        BEGIN {next_seq} END
+    """)
+
+
+def _migrate_v3(cursor):
+    """
+    person_summary: first entry, exit count, total time outside, final
+    exit and open sessions of every person, updated by triggers in the
+    same transaction as the attendance row.
+    """
+    cursor.execute("""
+        CREATE TABLE person_summary (
+            person_id INTEGER PRIMARY KEY REFERENCES persons(id),
+            first_entry TEXT,
+            last_entry TEXT,
+            exit_count INTEGER NOT NULL DEFAULT 0,
+            total_outside REAL NOT NULL DEFAULT 0,
+            final_exit TEXT,
+            open_sessions INTEGER NOT NULL DEFAULT 0,
+            change_seq INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX idx_person_summary_change_seq
+        ON person_summary (change_seq)
+    """)
+
+    next_seq = "(SELECT MAX(change_seq) + 1 FROM person_summary)"
+
+    # Scalar MIN/MAX return NULL if either side is NULL, hence COALESCE
+    cursor.execute(f"""
+        CREATE TRIGGER person_summary_insert AFTER INSERT ON attendance
+        BEGIN
+            INSERT OR IGNORE INTO person_summary (person_id)
+            VALUES (NEW.person_id);
+
+            UPDATE person_summary SET
+                first_entry = MIN(
+                    COALESCE(first_entry, NEW.entry_time), NEW.entry_time
+                ),
+                last_entry = MAX(
+                    COALESCE(last_entry, NEW.entry_time), NEW.entry_time
+                ),
+                exit_count = exit_count + (NEW.exit_time IS NOT NULL),
+                total_outside = total_outside
+                    + COALESCE(NEW.outside_duration, 0),
+                final_exit = COALESCE(
+                    MAX(final_exit, NEW.exit_time),
+                    final_exit, NEW.exit_time
+                ),
+                open_sessions = open_sessions + (NEW.exit_time IS NULL),
+                change_seq = {next_seq}
+            WHERE person_id = NEW.person_id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER person_summary_update
+        AFTER UPDATE OF exit_time, outside_duration ON attendance
+        BEGIN
+            UPDATE person_summary SET
+                exit_count = exit_count
+                    + (NEW.exit_time IS NOT NULL)
+                    - (OLD.exit_time IS NOT NULL),
+                total_outside = total_outside
+                    + COALESCE(NEW.outside_duration, 0)
+                    - COALESCE(OLD.outside_duration, 0),
+                final_exit = COALESCE(
+                    MAX(final_exit, NEW.exit_time),
+                    final_exit, NEW.exit_time
+                ),
+                open_sessions = open_sessions
+                    + (NEW.exit_time IS NULL)
+                    - (OLD.exit_time IS NULL),
+                change_seq = {next_seq}
+            WHERE person_id = NEW.person_id;
+        END
+    """)
+
+    # Deletes are rare (manual cleanup); rescan that person's times
+    of_person = "FROM attendance WHERE person_id = OLD.person_id"
+    cursor.execute(f"""
+        CREATE TRIGGER person_summary_delete AFTER DELETE ON attendance
+        BEGIN
+            UPDATE person_summary SET
+                first_entry = (SELECT MIN(entry_time) {of_person}),
+                last_entry = (SELECT MAX(entry_time) {of_person}),
+                exit_count = exit_count - (OLD.exit_time IS NOT NULL),
+                total_outside = total_outside
+                    - COALESCE(OLD.outside_duration, 0),
+                final_exit = (SELECT MAX(exit_time) {of_person}),
+                open_sessions = open_sessions - (OLD.exit_time IS NULL),
+                change_seq = {next_seq}
+            WHERE person_id = OLD.person_id;
+        END
+    """)
+
+    _fill_summary(cursor)
+
+
+def _migrate_v4(cursor):
+    """
+    Readers follow person_summary.change_seq now; stop numbering
+    attendance rows, which cost every attendance write a MAX() scan
+    and a second UPDATE. The column itself stays (old values only).
+    """
+    cursor.execute("DROP TRIGGER IF EXISTS attendance_insert_seq")
+    cursor.execute("DROP TRIGGER IF EXISTS attendance_update_seq")
+    cursor.execute("DROP INDEX IF EXISTS idx_attendance_change_seq")
 
+
+def _fill_summary(cursor):
+    """
+    Recompute every person's totals from the attendance history.
+    """
+    # Rebuilt rows must still look new to incremental readers
+    last_seq = cursor.execute(
+        "SELECT COALESCE(MAX(change_seq), 0) FROM person_summary"
+    ).fetchone()[0]
+
+    cursor.execute("DELETE FROM person_summary")
     cursor.execute("""
-        INSERT INTO attendance (person_name, entry_time, status)
-        VALUES (?, ?, 'Inside')
-    """, (person_name, entry_time))
+        INSERT INTO person_summary
+        SELECT person_id, MIN(entry_time), MAX(entry_time),
+               COUNT(exit_time), COALESCE(SUM(outside_duration), 0),
+               MAX(exit_time), SUM(exit_time IS NULL), ?
+        FROM attendance
+        GROUP BY person_id
+    """, (last_seq + 1,))
+
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+]
+
+
+def init_db(db_path):
+    """
+    Set up the attendance database, applying any schema
+    migrations it hasn't seen yet. Existing data is kept.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    cursor = conn.cursor()
+
+    # WAL lets the dashboard read while the recognizer writes
+    cursor.execute("PRAGMA journal_mode=WAL")
+
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    for number, migrate in enumerate(
+        MIGRATIONS[version:], start=version + 1
+    ):
+        # Each migration and its version bump commit together
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            migrate(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+            cursor.execute("COMMIT")
+        except sqlite3.Error:
+            cursor.execute("ROLLBACK")
+            conn.close()
+            raise
+        print(f"[INFO] Database migrated to schema version {number}")
 
-    conn.commit()
     conn.close()
 
 
-def update_exit(db_path, person_name, exit_time, outside_duration=0):
+def rebuild_summary(db_path):
     """
-    Update the most recent open session for a person
-    when they leave the monitored area.
+    Recompute person_summary from the full attendance history,
+    e.g. after editing attendance rows by hand.
     """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    cursor = conn.cursor()
+
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        _fill_summary(cursor)
+        people = cursor.execute(
+            "SELECT COUNT(*) FROM person_summary"
+        ).fetchone()[0]
+        cursor.execute("COMMIT")
+    except sqlite3.Error:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    print(f"[INFO] Rebuilt attendance summary for {people} people")
+
+
+# ===================== ATTENDANCE EVENTS =====================
+
+def _clean_name(person_name):
     # Basic validation to avoid empty names
     if not person_name or str(person_name).strip() == "":
-        person_name = "Unknown"
+        return "Unknown"
+    return person_name
+
+
+class PersonIdCache(OrderedDict):
+    """
+    Person name -> id for the `capacity` most recently used names.
+    """
+
+    def __init__(self, capacity=DB_PERSON_ID_CACHE):
+        super().__init__()
+        self.capacity = capacity
+
+    def get(self, name, default=None):
+        if name not in self:
+            return default
+        self.move_to_end(name)
+        return self[name]
+
+    def __setitem__(self, name, person_id):
+        super().__setitem__(name, person_id)
+        self.move_to_end(name)
+        if len(self) > self.capacity:
+            self.popitem(last=False)
+
+
+def _person_id(cursor, person_name, cache=None):
+    """
+    Id of a person, registering the name on first use.
+    """
+    name = _clean_name(person_name)
+    if cache is not None:
+        person_id = cache.get(name)
+        if person_id is not None:
+            return person_id
+
+    cursor.execute(
+        "INSERT OR IGNORE INTO persons (name) VALUES (?)", (name,)
+    )
+    person_id = cursor.execute(
+        "SELECT id FROM persons WHERE name = ?", (name,)
+    ).fetchone()[0]
+
+    if cache is not None:
+        cache[name] = person_id
+    return person_id
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
 
+def _insert_session(cursor, person_name, entry_time, camera,
+                    outside_duration=0, cache=None):
+    cursor.execute("""
+        INSERT INTO attendance
+            (person_id, entry_time, outside_duration, status, entry_camera)
+        VALUES (?, ?, ?, 'Inside', ?)
+    """, (
+        _person_id(cursor, person_name, cache), entry_time,
+        outside_duration, camera
+    ))
+
+
+def _close_session(cursor, person_name, exit_time, outside_duration, camera,
+                   cache=None):
+    # outside_duration=None keeps the value stored at entry
     cursor.execute("""
         UPDATE attendance
-        SET exit_time = ?, outside_duration = ?, status = 'Outside'
-        WHERE person_name = ? AND exit_time IS NULL
-    """, (exit_time, outside_duration, person_name))
+        SET exit_time = ?,
+            outside_duration = COALESCE(?, outside_duration),
+            status = 'Outside', exit_camera = ?
+        WHERE person_id = ? AND exit_time IS NULL
+    """, (
+        exit_time, outside_duration, camera,
+        _person_id(cursor, person_name, cache)
+    ))
+
 
+def create_session(db_path, person_name, entry_time, camera=None,
+                   outside_duration=0):
+    """
+    Record a new entry event for a person,
+    tagged with the camera that saw them. On a re-entry,
+    outside_duration is the time spent away since the last exit.
+    """
+    conn = sqlite3.connect(db_path)
+    _insert_session(
+        conn.cursor(), person_name, entry_time, camera, outside_duration
+    )
     conn.commit()
     conn.close()
+
+
+def update_exit(db_path, person_name, exit_time, outside_duration=None,
+                camera=None):
+    """
+    Update the most recent open session for a person
+    when they leave the monitored area.
+    """
+    conn = sqlite3.connect(db_path)
+    _close_session(
+        conn.cursor(), person_name, exit_time, outside_duration, camera
+    )
+    conn.commit()
+    conn.close()
+
+
+# ===================== BACKGROUND WRITER =====================
+
+class AttendanceWriter:
+    """
+    Background writer for attendance events.
+
+    create_session / update_exit only queue the event, so the caller
+    never waits on disk I/O. A single thread owns one WAL-mode
+    connection and commits queued events together, once batch_size
+    events are waiting or flush_interval seconds have passed.
+    """
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, db_path, batch_size=DB_BATCH_SIZE,
+                 flush_interval=DB_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.queue = queue.Queue()
+
+        # Person ids never change once assigned, so the writer keeps
+        # those of recently seen people
+        self._person_ids = PersonIdCache()
+
+        metrics.gauge("db_queue_depth", self.queue.qsize)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def create_session(self, person_name, entry_time, camera=None,
+                       outside_duration=0):
+        self.queue.put((
+            _insert_session,
+            (person_name, entry_time, camera, outside_duration)
+        ))
+
+    def update_exit(self, person_name, exit_time, outside_duration=None,
+                    camera=None):
+        self.queue.put((
+            _close_session,
+            (person_name, exit_time, outside_duration, camera)
+        ))
+
+    def flush(self, timeout=None):
+        """
+        Block until everything queued so far has been committed.
+        """
+        done = threading.Event()
+        self.queue.put((self._FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        """
+        Commit pending events and stop the writer thread.
+        """
+        self.queue.put((self._STOP, None))
+        self._thread.join(timeout)
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Durable at checkpoints; a crash loses at most the last batch
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+
+            # Gather more events until the batch is full or time is up;
+            # a flush or stop request commits right away
+            while (
+                len(batch) < self.batch_size
+                and batch[-1][0] not in (self._FLUSH, self._STOP)
+            ):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            waiters = []
+            events = 0
+            started = time.perf_counter()
+            cursor = conn.cursor()
+            try:
+                for action, args in batch:
+                    if action is self._FLUSH:
+                        waiters.append(args)
+                    elif action is self._STOP:
+                        running = False
+                    else:
+                        action(cursor, *args, cache=self._person_ids)
+                        events += 1
+                conn.commit()
+
+                if events:
+                    metrics.observe(
+                        "db_write", time.perf_counter() - started
+                    )
+                    metrics.inc("db_events", events)
+            except sqlite3.Error as e:
+                conn.rollback()
+                # Ids assigned in the failed batch were rolled back too
+                self._person_ids.clear()
+                print(f"[ERROR] Failed to write attendance batch: {e}")
+
+            for done in waiters:
+                done.set()
+
+        conn.close()
+
+
+# ===================== COMMAND LINE =====================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Maintenance of the IPMAS attendance database"
+    )
+    parser.add_argument("--db", default=DATABASE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser(
+        "migrate", help="Apply pending schema migrations"
+    ).set_defaults(run=init_db)
+    commands.add_parser(
+        "rebuild-summary", help="Recompute per-person totals from history"
+    ).set_defaults(run=rebuild_summary)
+
+    args = parser.parse_args()
+    args.run(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait
+)
+
+import cv2
+
+from config import (
+    KNOWN_FACES_DIR,
+    ENCODING_CACHE_DIR,
+    ENROLL_WORKERS,
+    ENROLL_DECODE_THREADS,
+    ENROLL_MAX_IMAGE_SIZE,
+    ENROLL_MIN_FACE_SIZE,
+    ENROLL_MIN_SHARPNESS
+)
+from face_utils import EncodingCache, iter_face_images, encode_sample
+
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 2.0
+
+
+# ===================== IMAGE DECODING =====================
+
+def load_rgb(path, max_size=ENROLL_MAX_IMAGE_SIZE):
+    """
+    Read an image as RGB, shrunk to max_size on its longest side.
+    Returns None if the file can't be decoded.
+    """
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+
+    h, w = image.shape[:2]
+    if max_size and max(h, w) > max_size:
+        factor = max_size / max(h, w)
+        image = cv2.resize(
+            image, (round(w * factor), round(h * factor)),
+            interpolation=cv2.INTER_AREA
+        )
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def _destination(known_dir, person, path):
+    """
+    Free file name for a copied sample in known_dir/<person>/.
+    """
+    person_dir = os.path.join(known_dir, person)
+    os.makedirs(person_dir, exist_ok=True)
+
+    stem, ext = os.path.splitext(os.path.basename(path))
+    dest = os.path.join(person_dir, stem + ext)
+    n = 1
+    while os.path.exists(dest):
+        dest = os.path.join(person_dir, f"{stem}_{n}{ext}")
+        n += 1
+    return dest
+
+
+# ===================== ENROLLMENT =====================
+
+def enroll(source_dir, known_dir=KNOWN_FACES_DIR,
+           cache_dir=ENCODING_CACHE_DIR, cropped=False,
+           workers=ENROLL_WORKERS, threads=ENROLL_DECODE_THREADS,
+           max_size=ENROLL_MAX_IMAGE_SIZE, min_face_size=ENROLL_MIN_FACE_SIZE,
+           min_sharpness=ENROLL_MIN_SHARPNESS, force=False):
+    """
+    Encode every image under source_dir/<person>/ in parallel and
+    store the results in the encoding cache, so the recognizer starts
+    without encoding anything.
+
+    Files are read and decoded by a thread pool; detection, quality
+    checks and encoding run in a process pool. When source_dir is not
+    known_dir, accepted images are copied into known_dir first; in
+    place, images the cache already has are skipped unless force=True.
+    Returns a dict of counts per outcome.
+    """
+    in_place = os.path.abspath(source_dir) == os.path.abspath(known_dir)
+    workers = workers or os.cpu_count() or 1
+
+    cache = EncodingCache(cache_dir)
+    items = list(iter_face_images(source_dir))
+    if in_place and not force:
+        # Images encoded before and unchanged since are skipped
+        items = cache.pending(items)
+
+    counts = {"images": len(items), "enrolled": 0}
+    records = []
+    if not items:
+        print("[INFO] Nothing new to enroll")
+        return counts
+
+    print(
+        f"[INFO] Enrolling {len(items)} images with {workers} workers"
+        + (" (pre-cropped faces)" if cropped else "")
+    )
+
+    started = time.monotonic()
+    last_report = started
+    done = 0
+
+    # Decoded images in flight are bounded to keep memory flat
+    max_pending = workers * 4
+    pending = iter(items)
+    decoding = {}
+    encoding = {}
+
+    ctx = mp.get_context("spawn")
+    with ThreadPoolExecutor(threads) as decoders, \
+            ProcessPoolExecutor(workers, mp_context=ctx) as encoders:
+        while True:
+            while len(decoding) + len(encoding) < max_pending:
+                item = next(pending, None)
+                if item is None:
+                    break
+                future = decoders.submit(load_rgb, item[1], max_size)
+                decoding[future] = item
+
+            if not decoding and not encoding:
+                break
+
+            finished, _ = wait(
+                list(decoding) + list(encoding), return_when=FIRST_COMPLETED
+            )
+            for future in finished:
+                if future in decoding:
+                    item = decoding.pop(future)
+                    rgb = future.result()
+                    if rgb is None:
+                        result = (None, "unreadable")
+                    else:
+                        encoding[encoders.submit(
+                            encode_sample, rgb, cropped, min_face_size,
+                            min_sharpness
+                        )] = item
+                        continue
+                else:
+                    item = encoding.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"[ERROR] Failed to encode {item[1]}: {e}")
+                        result = (None, "error")
+
+                done += 1
+                # A failed worker says nothing about the image; leave it
+                # out of the cache so the next run tries it again
+                if result[1] != "error":
+                    records.append(_accept(item, result, in_place, known_dir))
+                reason = result[1] or "enrolled"
+                counts[reason] = counts.get(reason, 0) + 1
+
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                rate = done / (now - started)
+                left = (len(items) - done) / rate if rate else 0
+                print(
+                    f"[INFO] {done}/{len(items)} images | "
+                    f"{counts['enrolled']} enrolled | "
+                    f"{rate:.1f} images/s | about {left:.0f}s left"
+                )
+
+    # Rejected copies are left out; in-place rejects are remembered
+    # so the recognizer doesn't try them again on every start
+    cache.add([r for r in records if r is not None])
+
+    elapsed = time.monotonic() - started
+    print(
+        f"[INFO] Enrolled {counts['enrolled']} of {len(items)} images "
+        f"in {elapsed:.1f}s"
+    )
+    for reason, count in sorted(counts.items()):
+        if reason not in ("images", "enrolled"):
+            print(f"[INFO]   rejected ({reason}): {count}")
+    return counts
+
+
+def _accept(item, result, in_place, known_dir):
+    """
+    Cache record for one processed image, copying accepted images
+    into known_dir when enrolling from elsewhere.
+    """
+    person, path, stat = item
+    encoding, _ = result
+
+    if in_place:
+        return person, path, stat, encoding
+    if encoding is None:
+        return None
+
+    dest = _destination(known_dir, person, path)
+    shutil.copy2(path, dest)
+    return person, dest, os.stat(dest), encoding
+
+
+# ===================== COMMAND LINE =====================
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Encode many known faces at once into the encoding cache"
+    )
+    parser.add_argument(
+        "source", nargs="?", default=KNOWN_FACES_DIR,
+        help="Folder of <person>/<images> (default: the known faces folder)"
+    )
+    parser.add_argument("--known-dir", default=KNOWN_FACES_DIR)
+    parser.add_argument("--cache-dir", default=ENCODING_CACHE_DIR)
+    parser.add_argument(
+        "--cropped", action="store_true",
+        help="Images are already cropped to one face; skip detection"
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Re-encode images the cache already has"
+    )
+    parser.add_argument("--workers", type=int, default=ENROLL_WORKERS,
+                        help="Encoding processes (0 = one per core)")
+    parser.add_argument("--threads", type=int, default=ENROLL_DECODE_THREADS,
+                        help="Image decoding threads")
+    parser.add_argument("--max-size", type=int, default=ENROLL_MAX_IMAGE_SIZE)
+    parser.add_argument("--min-face-size", type=int,
+                        default=ENROLL_MIN_FACE_SIZE)
+    parser.add_argument("--min-sharpness", type=float,
+                        default=ENROLL_MIN_SHARPNESS)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    enroll(
+        args.source,
+        known_dir=args.known_dir,
+        cache_dir=args.cache_dir,
+        cropped=args.cropped,
+        workers=args.workers,
+        threads=args.threads,
+        max_size=args.max_size,
+        min_face_size=args.min_face_size,
+        min_sharpness=args.min_sharpness,
+        force=args.force
+    )
+
+
+if __name__ == "__main__":
+    main()
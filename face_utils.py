@@ -1,157 +1,1339 @@
 import face_recognition
 import cv2
 import os
-from datetime import datetime
-from config import UNKNOWN_FACES_DIR, INTRUDER_SNAPSHOTS_DIR
+import json
+import time
+import numpy as np
+from tracking_utils import box_iou
+from config import (
+    FRAME_RESIZE_SCALE,
+    TRACK_IOU_THRESHOLD,
+    UNKNOWN_FACES_DIR,
+    ENCODING_CACHE_DIR,
+    INDEX_BACKEND,
+    IVF_NLIST,
+    IVF_NPROBE,
+    IVF_TRAIN_ITERATIONS,
+    MATCH_TOP_K,
+    SQ8_RERANK_FACTOR,
+    GALLERY_MODE,
+    PROTOTYPES_PER_PERSON,
+    PROTOTYPE_OUTLIER_DISTANCE,
+    PROTOTYPE_RERANK_MARGIN,
+    PROTOTYPE_RERANK_CANDIDATES
+)
 
 
-# ===================== KNOWN FACE LOADING =====================
+# ===================== ENCODING CACHE =====================
 
-def load_known_faces(known_dir):
-    encodings = []
-    names = []
+class EncodingCache:
+    """
+    On-disk store of known face encodings.
+
+    Encodings live in a single float32 .npy matrix (memory-mapped on
+    load) and a JSON manifest maps each image, keyed by its
+    "<person>/<file name>" path inside the known faces folder, its
+    mtime and size, to its row. Only new or modified images are
+    re-encoded, however the folder itself is reached.
+
+    Each save writes a new matrix file named in the manifest, so
+    replacing the manifest switches both at once.
+    """
+
+    # Caches written before the manifest named its matrix used this file
+    MATRIX_FILE = "encodings.npy"
+    MATRIX_PREFIX = "encodings"
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, self.MANIFEST_FILE)
+
+    def fingerprint(self):
+        """
+        Identify the current cache contents; changes whenever sync rewrites it.
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except OSError:
+            return ""
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    @staticmethod
+    def _key(person, path):
+        """
+        Manifest key of an image: the same for relative and absolute
+        paths to the known faces folder.
+        """
+        return f"{person}/{os.path.basename(path)}"
+
+    def _load(self):
+        """
+        Read the stored manifest and matrix.
+        Returns empty data if the cache is missing or corrupt.
+        """
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            matrix_path = os.path.join(
+                self.cache_dir,
+                os.path.basename(manifest.get("matrix", self.MATRIX_FILE))
+            )
+            matrix = np.load(matrix_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return {}, None
+
+        entries = {}
+        for entry in manifest.get("entries", []):
+            row = entry.get("row")
+            if row is not None and row >= len(matrix):
+                continue
+            # Older caches stored the path as it was passed in
+            entry["path"] = self._key(entry["name"], entry["path"])
+            entries[entry["path"]] = entry
+
+        return entries, matrix
+
+    def read(self):
+        """
+        Return the stored matrix and names without checking the images.
+        """
+        entries, matrix = self._load()
+        if matrix is None:
+            return np.empty((0, 128), dtype=np.float32), []
+
+        rows = sorted(
+            (e["row"], e["name"]) for e in entries.values()
+            if e["row"] is not None
+        )
+        return matrix, [name for _, name in rows]
+
+    def _save(self, entries, matrix):
+        """
+        Atomically replace the manifest and matrix on disk.
+
+        The matrix goes to a new file first; the manifest naming it is
+        then swapped in with one rename, so a crash leaves either the
+        old or the new pair, never a mix. Returns the new matrix path.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        matrix_file = f"{self.MATRIX_PREFIX}-{time.time_ns():x}.npy"
+        matrix_path = os.path.join(self.cache_dir, matrix_file)
+        tmp_manifest = self.manifest_path + ".tmp"
+
+        np.save(matrix_path, matrix)
+        with open(tmp_manifest, "w") as f:
+            json.dump({"matrix": matrix_file, "entries": entries}, f)
+        os.replace(tmp_manifest, self.manifest_path)
+
+        # Older matrices are unreferenced now; one still memory-mapped
+        # elsewhere (Windows) is removed by a later save
+        for name in os.listdir(self.cache_dir):
+            if (
+                name != matrix_file and name.endswith(".npy")
+                and name.startswith(self.MATRIX_PREFIX)
+            ):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+        return matrix_path
+
+    def sync(self, known_dir):
+        """
+        Bring the cache in line with the images under known_dir.
+        Returns the encoding matrix and the matching list of names.
+        """
+        cached, old_matrix = self._load()
+
+        entries = []
+        rows = []
+        changed = False
+
+        for person, img_path, stat in iter_face_images(known_dir):
+            key = self._key(person, img_path)
+            old = cached.pop(key, None)
+
+            if (
+                old is not None
+                and old["mtime_ns"] == stat.st_mtime_ns
+                and old["size"] == stat.st_size
+            ):
+                # Copy out of the memory map so the old file can be replaced
+                encoding = (
+                    np.array(old_matrix[old["row"]])
+                    if old["row"] is not None else None
+                )
+                # Rows appended by add() are out of walk order; rewrite
+                # so every name stays next to its own row
+                if encoding is not None and old["row"] != len(rows):
+                    changed = True
+            else:
+                encoding = _encode_image(img_path)
+                changed = True
+
+            entry = {
+                "path": key,
+                "name": person,
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "row": None
+            }
+
+            # Images without a usable face are remembered too,
+            # so they are not re-encoded on every start
+            if encoding is not None:
+                entry["row"] = len(rows)
+                rows.append(encoding)
+
+            entries.append(entry)
+
+        # Anything left over was deleted from disk; caches written as
+        # float64 by older versions are converted once
+        if cached or (
+            old_matrix is not None and old_matrix.dtype != np.float32
+        ):
+            changed = True
 
+        if not changed and old_matrix is not None:
+            matrix = old_matrix
+        elif rows:
+            matrix = np.asarray(np.stack(rows), dtype=np.float32)
+        else:
+            matrix = np.empty((0, 128), dtype=np.float32)
+
+        if changed or old_matrix is None:
+            old_matrix = None
+            matrix = np.load(self._save(entries, matrix), mmap_mode="r")
+
+        names = [e["name"] for e in entries if e["row"] is not None]
+        return matrix, names
+
+    def pending(self, images):
+        """
+        Keep the (person, path, stat) tuples of images that have no
+        up-to-date entry in the cache.
+        """
+        cached, _ = self._load()
+        pending = []
+        for person, path, stat in images:
+            entry = cached.get(self._key(person, path))
+            if not (
+                entry is not None
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size
+            ):
+                pending.append((person, path, stat))
+        return pending
+
+    def add(self, records):
+        """
+        Store encodings computed elsewhere (e.g. by bulk enrollment)
+        as (person, image path, stat, encoding or None) records,
+        replacing any older entries for the same paths.
+        """
+        cached, old_matrix = self._load()
+
+        entries = []
+        rows = []
+        fresh = {self._key(person, path) for person, path, _, _ in records}
+
+        for path, entry in cached.items():
+            if path in fresh:
+                continue
+            entry = dict(entry)
+            if entry["row"] is not None:
+                # Copy out of the memory map so the file can be replaced
+                rows.append(np.array(old_matrix[entry["row"]]))
+                entry["row"] = len(rows) - 1
+            entries.append(entry)
+        old_matrix = None
+
+        for person, path, stat, encoding in records:
+            entry = {
+                "path": self._key(person, path),
+                "name": person,
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "row": None
+            }
+            if encoding is not None:
+                entry["row"] = len(rows)
+                rows.append(encoding)
+            entries.append(entry)
+
+        if rows:
+            matrix = np.asarray(np.stack(rows), dtype=np.float32)
+        else:
+            matrix = np.empty((0, 128), dtype=np.float32)
+        self._save(entries, matrix)
+
+
+def iter_face_images(known_dir):
+    """
+    Yield (person, image path, stat) for every file in known_dir/<person>/.
+    """
     if not os.path.exists(known_dir):
-        return encodings, names
+        return
 
-    for person in os.listdir(known_dir):
+    for person in sorted(os.listdir(known_dir)):
         person_path = os.path.join(known_dir, person)
         if not os.path.isdir(person_path):
             continue
 
-        for img in os.listdir(person_path):
-            img_path = os.path.join(person_path, img)
+        with os.scandir(person_path) as it:
+            files = sorted(
+                (e for e in it if e.is_file()), key=lambda e: e.name
+            )
+
+        for entry in files:
             try:
-                image = face_recognition.load_image_file(img_path)
-                face_encs = face_recognition.face_encodings(image)
-                if face_encs:
-                    encodings.append(face_encs[0])
-                    names.append(person)
-            except Exception:
-                # Skip unreadable or invalid images
+                yield person, entry.path, entry.stat()
+            except OSError:
                 continue
 
-    return encodings, names
 
+def _encode_image(img_path):
+    """
+    Encode the first face found in an image file, or return None.
+    """
+    try:
+        image = face_recognition.load_image_file(img_path)
+        face_encs = face_recognition.face_encodings(image)
+    except Exception:
+        # Skip unreadable or invalid images
+        return None
 
-# ===================== FACE MATCHING =====================
+    return face_encs[0] if face_encs else None
 
-def recognize_face(face_encoding, known_encodings, known_names, threshold):
-    if not known_encodings:
-        return None
 
-    distances = face_recognition.face_distance(
-        known_encodings, face_encoding
-    )
+def encode_sample(rgb, cropped=False, min_face_size=0, min_sharpness=0):
+    """
+    Check and encode one enrollment image (RGB).
 
-    min_dist = distances.min()
-    if min_dist < threshold:
-        return known_names[distances.argmin()]
+    Returns (encoding, None) or (None, reason) when the image has no
+    face, several faces, or a face that is too small or too blurry.
+    With cropped=True the whole image is the face and detection is
+    skipped.
+    """
+    h, w = rgb.shape[:2]
+    if cropped:
+        locations = [(0, w, h, 0)]
+    else:
+        locations = face_recognition.face_locations(rgb, model="hog")
+        if not locations:
+            return None, "no face"
+        if len(locations) > 1:
+            return None, "multiple faces"
 
-    return None
+    top, right, bottom, left = locations[0]
+    top, left = max(0, top), max(0, left)
+    bottom, right = min(h, bottom), min(w, right)
 
+    if min(bottom - top, right - left) < min_face_size:
+        return None, "face too small"
 
-# ===================== FACE REGISTRATION =====================
+    if min_sharpness:
+        grey = cv2.cvtColor(rgb[top:bottom, left:right], cv2.COLOR_RGB2GRAY)
+        if cv2.Laplacian(grey, cv2.CV_64F).var() < min_sharpness:
+            return None, "blurry"
 
-def register_new_person(cap, save_dir, person_name, samples=15):
-    person_dir = os.path.join(save_dir, person_name)
-    os.makedirs(person_dir, exist_ok=True)
+    encodings = face_recognition.face_encodings(rgb, locations)
+    if not encodings:
+        return None, "no face"
+    return np.asarray(encodings[0], dtype=np.float32), None
 
-    print(f"[INFO] Starting registration for {person_name}. Please face the camera.")
 
-    saved = 0
-    attempts = 0
-    max_attempts = samples * 5   # avoid endless capture attempts
+# ===================== KNOWN FACE LOADING =====================
 
-    while saved < samples and attempts < max_attempts:
-        ret, frame = cap.read()
-        if not ret:
-            attempts += 1
-            continue
+def load_known_faces(known_dir, cache_dir=ENCODING_CACHE_DIR):
+    """
+    Return all known encodings as one contiguous (n, 128) float32
+    matrix, plus the name of each row.
+    """
+    if cache_dir:
+        matrix, names = EncodingCache(cache_dir).sync(known_dir)
+        # Copied out of the memory map so the cache file can be replaced
+        return np.array(matrix, dtype=np.float32), names
 
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        locations = face_recognition.face_locations(rgb, model="hog")
-        encodings = face_recognition.face_encodings(rgb, locations)
+    encodings = []
+    names = []
 
-        display = frame.copy()
+    for person, img_path, _ in iter_face_images(known_dir):
+        encoding = _encode_image(img_path)
+        if encoding is not None:
+            encodings.append(encoding)
+            names.append(person)
 
-        if len(encodings) == 1:
-            top, right, bottom, left = locations[0]
+    if not encodings:
+        return np.empty((0, 128), dtype=np.float32), names
+    return np.asarray(encodings, dtype=np.float32), names
 
-            # Validate crop bounds
-            h, w = frame.shape[:2]
-            if top < bottom and left < right and bottom <= h and right <= w:
-                face_img = frame[top:bottom, left:right]
 
-                img_path = os.path.join(
-                    person_dir, f"{saved}.jpg"
-                )
-                cv2.imwrite(img_path, face_img)
+# ===================== GALLERY INDEX =====================
 
-                saved += 1
+def pairwise_distances(queries, matrix, sq_norms=None):
+    """
+    Euclidean distances between every query and every gallery row,
+    computed with a single matrix multiply.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, 128)
+    if sq_norms is None:
+        sq_norms = np.einsum("ij,ij->i", matrix, matrix)
 
-                cv2.rectangle(
-                    display, (left, top), (right, bottom), (0, 255, 0), 2
-                )
-                cv2.putText(
-                    display,
-                    f"Captured {saved}/{samples}",
-                    (left, top - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.8,
-                    (0, 255, 0),
-                    2
+    q_norms = np.einsum("ij,ij->i", queries, queries)
+
+    # |q - g|^2 = |q|^2 + |g|^2 - 2 q.g
+    sq = q_norms[:, None] + sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq)
+
+
+def _top_k(distances, ids, k):
+    """
+    Pick the k smallest distances of one query, padded with -1 / inf.
+    """
+    out_d = np.full(k, np.inf, dtype=np.float32)
+    out_i = np.full(k, -1, dtype=np.int64)
+
+    n = min(k, len(distances))
+    if n == 0:
+        return out_d, out_i
+
+    part = np.argpartition(distances, n - 1)[:n]
+    order = part[np.argsort(distances[part])]
+
+    out_d[:n] = distances[order]
+    out_i[:n] = ids[order]
+    return out_d, out_i
+
+
+class FaceIndex:
+    """
+    Common interface of the gallery search backends.
+
+    Vectors are stored under integer ids chosen by the caller.
+    search() returns (distances, ids) arrays of shape (queries, k),
+    padded with inf / -1 when fewer than k vectors are stored.
+    """
+
+    kind = None
+
+    def build(self, vectors, ids):
+        raise NotImplementedError
+
+    def add(self, vectors, ids):
+        raise NotImplementedError
+
+    def remove(self, ids):
+        raise NotImplementedError
+
+    def search(self, queries, k=1):
+        raise NotImplementedError
+
+    def copy(self):
+        raise NotImplementedError
+
+    def save(self, path, **meta):
+        raise NotImplementedError
+
+    def nbytes(self):
+        """
+        Memory held by the stored vectors and their bookkeeping.
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class FlatIndex(FaceIndex):
+    """
+    Exact brute-force scan over every stored vector.
+    """
+
+    kind = "flat"
+
+    def __init__(self):
+        self.build(np.empty((0, 128)), np.empty(0))
+
+    def build(self, vectors, ids):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.vectors = self.vectors.reshape(-1, 128)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+
+    def add(self, vectors, ids):
+        self.build(
+            np.concatenate([self.vectors, np.asarray(vectors).reshape(-1, 128)]),
+            np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        )
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids, ids)
+        if not keep.all():
+            self.vectors = self.vectors[keep]
+            self.ids = self.ids[keep]
+            self.sq_norms = self.sq_norms[keep]
+
+    def search(self, queries, k=1):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, 128)
+        out_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_i = np.full((len(queries), k), -1, dtype=np.int64)
+
+        if len(self.ids) == 0 or len(queries) == 0:
+            return out_d, out_i
+
+        distances = pairwise_distances(queries, self.vectors, self.sq_norms)
+        for q in range(len(queries)):
+            out_d[q], out_i[q] = _top_k(distances[q], self.ids, k)
+
+        return out_d, out_i
+
+    def copy(self):
+        # Arrays are never modified in place, so sharing them is safe
+        other = FlatIndex.__new__(FlatIndex)
+        other.vectors = self.vectors
+        other.ids = self.ids
+        other.sq_norms = self.sq_norms
+        return other
+
+    def save(self, path, **meta):
+        np.savez(
+            path, kind=self.kind, vectors=self.vectors, ids=self.ids, **meta
+        )
+
+    @classmethod
+    def _from_file(cls, data):
+        index = cls.__new__(cls)
+        index.build(data["vectors"], data["ids"])
+        return index
+
+    def nbytes(self):
+        return self.vectors.nbytes + self.sq_norms.nbytes + self.ids.nbytes
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class IVFIndex(FaceIndex):
+    """
+    Approximate inverted-file index.
+
+    Vectors are clustered around nlist k-means centroids; a query only
+    scans the nprobe lists whose centroids are closest to it. Until
+    enough vectors exist to train the clusters, everything is kept in
+    a single list and searched exactly.
+    """
+
+    kind = "ivf"
+
+    # Vectors needed per cluster before the centroids are trained
+    MIN_POINTS_PER_LIST = 4
+
+    def __init__(self, nlist=64, nprobe=8, iterations=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.build(np.empty((0, 128)), np.empty(0))
+
+    def build(self, vectors, ids):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        vectors = vectors.reshape(-1, 128)
+        ids = np.asarray(ids, dtype=np.int64)
+
+        if len(vectors) >= self.nlist * self.MIN_POINTS_PER_LIST:
+            self.centroids = self._train(vectors)
+            assignment = self._assign(vectors)
+        else:
+            self.centroids = None
+            assignment = np.zeros(len(vectors), dtype=np.int64)
+
+        n_lists = len(self.centroids) if self.centroids is not None else 1
+        self.lists = []
+        for l in range(n_lists):
+            member = assignment == l
+            self.lists.append(self._make_list(vectors[member], ids[member]))
+
+    def _make_list(self, vectors, ids):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        return (vectors, ids, np.einsum("ij,ij->i", vectors, vectors))
+
+    def _train(self, vectors):
+        """
+        Plain k-means on a sample of the vectors.
+        """
+        rng = np.random.default_rng(self.seed)
+
+        sample_size = min(len(vectors), self.nlist * 256)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)]
+
+        for _ in range(self.iterations):
+            assignment = pairwise_distances(sample, centroids).argmin(axis=1)
+            for l in range(self.nlist):
+                member = sample[assignment == l]
+                if len(member):
+                    centroids[l] = member.mean(axis=0)
+                else:
+                    # Re-seed empty clusters on a random sample
+                    centroids[l] = sample[rng.integers(len(sample))]
+
+        return np.ascontiguousarray(centroids)
+
+    def _assign(self, vectors):
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return pairwise_distances(vectors, self.centroids).argmin(axis=1)
+
+    def _all(self):
+        vectors = np.concatenate([v for v, _, _ in self.lists])
+        ids = np.concatenate([i for _, i, _ in self.lists])
+        return vectors, ids
+
+    def add(self, vectors, ids):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 128)
+        ids = np.asarray(ids, dtype=np.int64)
+
+        if self.centroids is None:
+            all_vectors, all_ids = self._all()
+            self.build(
+                np.concatenate([all_vectors, vectors]),
+                np.concatenate([all_ids, ids])
+            )
+            return
+
+        assignment = self._assign(vectors)
+        for l in np.unique(assignment):
+            member = assignment == l
+            old_v, old_i, _ = self.lists[l]
+            self.lists[l] = self._make_list(
+                np.concatenate([old_v, vectors[member]]),
+                np.concatenate([old_i, ids[member]])
+            )
+
+    def remove(self, ids):
+        for l, (vectors, list_ids, _) in enumerate(self.lists):
+            keep = ~np.isin(list_ids, ids)
+            if not keep.all():
+                self.lists[l] = self._make_list(vectors[keep], list_ids[keep])
+
+    def search(self, queries, k=1):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, 128)
+        out_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_i = np.full((len(queries), k), -1, dtype=np.int64)
+
+        if len(queries) == 0 or len(self) == 0:
+            return out_d, out_i
+
+        if self.centroids is None:
+            probes = np.zeros((len(queries), 1), dtype=np.int64)
+        else:
+            nprobe = min(self.nprobe, len(self.centroids))
+            to_centroids = pairwise_distances(queries, self.centroids)
+            probes = np.argpartition(to_centroids, nprobe - 1, axis=1)
+            probes = probes[:, :nprobe]
+
+        cand_d = [[] for _ in range(len(queries))]
+        cand_i = [[] for _ in range(len(queries))]
+
+        # Scan each probed list once for all queries that selected it
+        for l in np.unique(probes):
+            vectors, ids, sq_norms = self.lists[l]
+            if len(ids) == 0:
+                continue
+
+            qs = np.nonzero((probes == l).any(axis=1))[0]
+            distances = pairwise_distances(queries[qs], vectors, sq_norms)
+            for row, q in enumerate(qs):
+                cand_d[q].append(distances[row])
+                cand_i[q].append(ids)
+
+        for q in range(len(queries)):
+            if cand_d[q]:
+                out_d[q], out_i[q] = _top_k(
+                    np.concatenate(cand_d[q]), np.concatenate(cand_i[q]), k
                 )
 
-                cv2.imshow("Registration", display)
-                cv2.waitKey(400)  # slower capture improves image clarity
+        return out_d, out_i
+
+    def copy(self):
+        # Lists are replaced rather than modified, so a shallow copy is enough
+        other = IVFIndex.__new__(IVFIndex)
+        other.__dict__.update(self.__dict__)
+        other.lists = list(self.lists)
+        return other
+
+    def save(self, path, **meta):
+        vectors, ids = self._all()
+        sizes = np.array([len(i) for _, i, _ in self.lists], dtype=np.int64)
+        np.savez(
+            path,
+            kind=self.kind,
+            params=np.array(
+                [self.nlist, self.nprobe, self.iterations, self.seed]
+            ),
+            centroids=(
+                self.centroids if self.centroids is not None
+                else np.empty((0, 128), dtype=np.float32)
+            ),
+            vectors=vectors,
+            ids=ids,
+            sizes=sizes,
+            **meta
+        )
+
+    @classmethod
+    def _from_file(cls, data):
+        nlist, nprobe, iterations, seed = [int(v) for v in data["params"]]
+        index = cls.__new__(cls)
+        index.nlist = nlist
+        index.nprobe = nprobe
+        index.iterations = iterations
+        index.seed = seed
+        index.centroids = data["centroids"] if len(data["centroids"]) else None
+
+        offsets = np.concatenate([[0], np.cumsum(data["sizes"])])
+        index.lists = [
+            index._make_list(
+                data["vectors"][offsets[l]:offsets[l + 1]],
+                data["ids"][offsets[l]:offsets[l + 1]]
+            )
+            for l in range(len(data["sizes"]))
+        ]
+        return index
+
+    def nbytes(self):
+        centroids = (
+            self.centroids.nbytes if self.centroids is not None else 0
+        )
+        return centroids + sum(
+            v.nbytes + i.nbytes + n.nbytes for v, i, n in self.lists
+        )
+
+    def __len__(self):
+        return sum(len(i) for _, i, _ in self.lists)
+
+
+class SQ8Index(FaceIndex):
+    """
+    Scan over 8-bit scalar-quantized vectors.
+
+    Every dimension is mapped linearly from its [min, max] range onto
+    0..255, so a sample takes 128 bytes instead of 512 and the scan
+    reads a quarter of the memory. The `rerank_factor * k` closest
+    candidates are then re-checked against the exact float32 vectors,
+    which makes the returned distances exact. With rerank_factor=0 the
+    float vectors are not kept and distances are approximate.
+    """
+
+    kind = "sq8"
+
+    # Below this many vectors the ranges are re-fitted on every add
+    MIN_TRAIN_POINTS = 256
+
+    # Rows converted to float per block of the scan (keeps it in cache)
+    SCAN_BLOCK = 4096
+
+    def __init__(self, rerank_factor=4):
+        self.rerank_factor = rerank_factor
+        self.build(np.empty((0, 128)), np.empty(0))
+
+    def build(self, vectors, ids):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        vectors = vectors.reshape(-1, 128)
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+        if len(vectors):
+            self.low = vectors.min(axis=0)
+            span = vectors.max(axis=0) - self.low
+            self.step = np.where(span > 0, span / 255, 1).astype(np.float32)
+        else:
+            self.low = np.zeros(128, dtype=np.float32)
+            self.step = np.ones(128, dtype=np.float32)
+
+        self.codes = self._encode(vectors)
+        # Vectors are shared, not copied, when already float32
+        self.vectors = vectors if self.rerank_factor else None
+        self._update_norms()
+
+    def _encode(self, vectors):
+        codes = np.rint((vectors - self.low) / self.step)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def _decode(self, codes):
+        return self.low + codes.astype(np.float32) * self.step
+
+    def _update_norms(self):
+        # Norms of the reconstructed vectors, as the scan sees them
+        decoded = self._decode(self.codes)
+        self.sq_norms = np.einsum("ij,ij->i", decoded, decoded)
+
+    def add(self, vectors, ids):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 128)
+        ids = np.asarray(ids, dtype=np.int64)
+
+        exact = self.vectors if self.vectors is not None else (
+            self._decode(self.codes)
+        )
+        if len(self) + len(vectors) < self.MIN_TRAIN_POINTS:
+            # Ranges fitted on a handful of faces would clip new ones
+            self.build(
+                np.concatenate([exact, vectors]),
+                np.concatenate([self.ids, ids])
+            )
+            return
+
+        self.codes = np.concatenate([self.codes, self._encode(vectors)])
+        self.ids = np.concatenate([self.ids, ids])
+        if self.vectors is not None:
+            self.vectors = np.concatenate([self.vectors, vectors])
+        self._update_norms()
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids, ids)
+        if not keep.all():
+            self.codes = self.codes[keep]
+            self.ids = self.ids[keep]
+            self.sq_norms = self.sq_norms[keep]
+            if self.vectors is not None:
+                self.vectors = self.vectors[keep]
+
+    def _scan(self, queries):
+        """
+        Approximate squared distances from every query to every code.
+        """
+        # q.x = q.low + (q * step).code, so codes never need decoding
+        scaled = queries * self.step
+        offset = queries @ self.low
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+
+        sq = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), self.SCAN_BLOCK):
+            block = self.codes[start:start + self.SCAN_BLOCK]
+            sq[:, start:start + len(block)] = (
+                block.astype(np.float32) @ scaled.T
+            ).T
+
+        sq += offset[:, None]
+        sq *= -2.0
+        sq += q_norms[:, None]
+        sq += self.sq_norms[None, :]
+        np.maximum(sq, 0.0, out=sq)
+        return sq
+
+    def search(self, queries, k=1):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, 128)
+        out_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_i = np.full((len(queries), k), -1, dtype=np.int64)
+
+        if len(self.ids) == 0 or len(queries) == 0:
+            return out_d, out_i
+
+        approx = self._scan(queries)
+        if self.vectors is None:
+            approx = np.sqrt(approx)
+            for q in range(len(queries)):
+                out_d[q], out_i[q] = _top_k(approx[q], self.ids, k)
+            return out_d, out_i
+
+        rows = np.arange(len(self.ids))
+        n = min(len(rows), k * self.rerank_factor)
+        for q in range(len(queries)):
+            candidates = np.argpartition(approx[q], n - 1)[:n]
+            exact = pairwise_distances(
+                queries[q], self.vectors[candidates]
+            )[0]
+            out_d[q], out_i[q] = _top_k(exact, self.ids[candidates], k)
+
+        return out_d, out_i
+
+    def copy(self):
+        # Arrays are never modified in place, so sharing them is safe
+        other = SQ8Index.__new__(SQ8Index)
+        other.__dict__.update(self.__dict__)
+        return other
+
+    def save(self, path, **meta):
+        vectors = (
+            self.vectors if self.vectors is not None
+            else self._decode(self.codes)
+        )
+        np.savez(
+            path,
+            kind=self.kind,
+            params=np.array([self.rerank_factor]),
+            vectors=vectors,
+            ids=self.ids,
+            **meta
+        )
+
+    @classmethod
+    def _from_file(cls, data):
+        index = cls.__new__(cls)
+        index.rerank_factor = int(data["params"][0])
+        index.build(data["vectors"], data["ids"])
+        return index
+
+    def nbytes(self):
+        total = self.codes.nbytes + self.sq_norms.nbytes + self.ids.nbytes
+        if self.vectors is not None:
+            total += self.vectors.nbytes
+        return total
+
+    def __len__(self):
+        return len(self.ids)
+
+
+INDEX_BACKENDS = {
+    FlatIndex.kind: FlatIndex,
+    IVFIndex.kind: IVFIndex,
+    SQ8Index.kind: SQ8Index,
+}
+
+
+def create_index(backend=INDEX_BACKEND):
+    """
+    Build an empty index for the configured backend.
+    """
+    if backend == IVFIndex.kind:
+        return IVFIndex(IVF_NLIST, IVF_NPROBE, IVF_TRAIN_ITERATIONS)
+    if backend == SQ8Index.kind:
+        return SQ8Index(SQ8_RERANK_FACTOR)
+    if backend == FlatIndex.kind:
+        return FlatIndex()
+    raise ValueError(f"Unknown index backend: {backend}")
+
+
+def load_index(path, fingerprint=None):
+    """
+    Load an index written by FaceIndex.save().
+    Returns None if it was saved with a different fingerprint.
+    """
+    with np.load(path) as data:
+        if fingerprint is not None and (
+            "fingerprint" not in data.files
+            or str(data["fingerprint"]) != fingerprint
+        ):
+            return None
+
+        kind = str(data["kind"])
+        if kind not in INDEX_BACKENDS:
+            raise ValueError(f"Unknown index backend: {kind}")
+        return INDEX_BACKENDS[kind]._from_file(data)
+
+
+# ===================== GALLERY =====================
+
+def compute_prototypes(samples, count=1, outlier_distance=None):
+    """
+    Reduce one person's samples to at most `count` representative vectors.
+
+    Samples farther than outlier_distance from the coordinate-wise
+    median are dropped first (always keeping the closest half). One
+    prototype is the mean of the rest; more are chosen by k-medoids.
+    """
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1, 128)
+    if len(samples) <= 1:
+        return samples
+
+    if outlier_distance:
+        spread = np.linalg.norm(samples - np.median(samples, axis=0), axis=1)
+        keep = spread <= outlier_distance
+        if keep.sum() < (len(samples) + 1) // 2:
+            keep = spread <= np.median(spread)
+        samples = samples[keep]
+
+    if count <= 1:
+        return samples.mean(axis=0, keepdims=True)
+
+    if len(samples) <= count:
+        return samples
+
+    distances = pairwise_distances(samples, samples)
+
+    # Farthest-point initialisation, then alternate assign / update
+    medoids = [int(distances.sum(axis=1).argmin())]
+    while len(medoids) < count:
+        medoids.append(int(distances[:, medoids].min(axis=1).argmax()))
+
+    for _ in range(10):
+        assignment = distances[:, medoids].argmin(axis=1)
+        updated = []
+        for c in range(count):
+            members = np.nonzero(assignment == c)[0]
+            if len(members) == 0:
+                updated.append(medoids[c])
+                continue
+            cost = distances[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[cost.argmin()]))
+        if updated == medoids:
+            break
+        medoids = updated
+
+    return samples[medoids]
+
+
+class Gallery:
+    """
+    Immutable snapshot of the known faces.
+
+    add_person / remove_person return a new Gallery instead of
+    modifying this one, so a reader holding a reference never sees
+    a half-updated set of encodings and names. Publishing an update
+    is a single reference assignment.
+
+    Rows carry increasing integer ids, which is what the search
+    index stores and returns; the index holds the only copy of the
+    vectors (in whatever form its backend uses). In "prototypes" mode
+    the rows are a
+    few representative vectors per person instead of every sample;
+    the samples themselves are only kept when close calls are
+    re-ranked against them.
+    """
+
+    def __init__(self, encodings=None, names=None, index=None,
+                 mode=GALLERY_MODE, rerank_margin=PROTOTYPE_RERANK_MARGIN):
+        if encodings is None or len(encodings) == 0:
+            encodings = np.empty((0, 128), dtype=np.float32)
+
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        names = list(names or [])
+
+        self.mode = mode
+        self.rerank_margin = rerank_margin
+        self.samples = None
+
+        if mode == "prototypes":
+            rows_by_name = {}
+            for row, name in enumerate(names):
+                rows_by_name.setdefault(name, []).append(row)
+            grouped = {
+                name: encodings[rows] for name, rows in rows_by_name.items()
+            }
+
+            if rerank_margin > 0:
+                self.samples = grouped
+
+            rows = [self._prototypes(s) for s in grouped.values()]
+            names = [
+                name for name, r in zip(grouped, rows) for _ in range(len(r))
+            ]
+            encodings = (
+                np.concatenate(rows) if rows
+                else np.empty((0, 128), dtype=np.float32)
+            )
+        elif mode != "samples":
+            raise ValueError(f"Unknown gallery mode: {mode}")
+
+        self.names = names
+        self.ids = np.arange(len(self.names), dtype=np.int64)
+
+        if index is None:
+            index = create_index()
+            index.build(encodings, self.ids)
+        self.index = index
+
+        self._update_labels()
+
+    def _prototypes(self, samples):
+        if self.mode != "prototypes":
+            return np.asarray(samples, dtype=np.float32).reshape(-1, 128)
+        return compute_prototypes(
+            samples, PROTOTYPES_PER_PERSON, PROTOTYPE_OUTLIER_DISTANCE
+        )
+
+    def _update_labels(self):
+        # Integer label per row, used to find the best *other* identity
+        self.identities = sorted(set(self.names))
+        lookup = {name: i for i, name in enumerate(self.identities)}
+        self.labels = np.array(
+            [lookup[name] for name in self.names], dtype=np.int32
+        )
+
+    def _derive(self, names, ids, index, samples):
+        other = Gallery.__new__(Gallery)
+        other.mode = self.mode
+        other.rerank_margin = self.rerank_margin
+        other.samples = samples
+        other.names = names
+        other.ids = ids
+        other.index = index
+        other._update_labels()
+        return other
+
+    @classmethod
+    def load(cls, known_dir, cache_dir=ENCODING_CACHE_DIR):
+        encodings, names = load_known_faces(known_dir, cache_dir)
+
+        # Only the IVF clusters are worth persisting; the rest build in
+        # a single pass
+        if not cache_dir or INDEX_BACKEND != IVFIndex.kind:
+            return cls(encodings, names)
+
+        # Reuse the trained index while the encoding cache is unchanged
+        index_path = os.path.join(cache_dir, f"index_{INDEX_BACKEND}.npz")
+        fingerprint = (
+            f"{EncodingCache(cache_dir).fingerprint()}"
+            f":{IVF_NLIST}:{IVF_TRAIN_ITERATIONS}:{GALLERY_MODE}"
+            f":{PROTOTYPES_PER_PERSON}:{PROTOTYPE_OUTLIER_DISTANCE}"
+        )
+
+        index = None
+        if os.path.exists(index_path):
+            try:
+                index = load_index(index_path, fingerprint)
+            except (OSError, KeyError, ValueError):
+                index = None
+
+        if index is not None:
+            index.nprobe = IVF_NPROBE
+            return cls(encodings, names, index)
+
+        gallery = cls(encodings, names)
+        gallery.index.save(index_path, fingerprint=fingerprint)
+        return gallery
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_person(self, name, encodings):
+        """
+        Return a new gallery with the given samples for a person.
+        Any samples already stored for that name are replaced.
+        """
+        base = self.remove_person(name)
+        if len(encodings) == 0:
+            return base
+
+        samples = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        new = self._prototypes(samples)
+        start = base.ids[-1] + 1 if len(base.ids) else 0
+        new_ids = np.arange(start, start + len(new), dtype=np.int64)
+
+        index = base.index.copy()
+        index.add(new, new_ids)
+
+        stored = base.samples
+        if stored is not None:
+            stored = dict(stored)
+            stored[name] = samples
+
+        return self._derive(
+            base.names + [name] * len(new),
+            np.concatenate([base.ids, new_ids]),
+            index,
+            stored
+        )
+
+    def remove_person(self, name):
+        """
+        Return a new gallery without any samples for a person.
+        """
+        drop = np.array([n == name for n in self.names], dtype=bool)
+        if not drop.any():
+            return self
+
+        index = self.index.copy()
+        index.remove(self.ids[drop])
+
+        stored = self.samples
+        if stored is not None:
+            stored = {n: s for n, s in stored.items() if n != name}
+
+        keep = ~drop
+        return self._derive(
+            [n for n, d in zip(self.names, drop) if not d],
+            self.ids[keep],
+            index,
+            stored
+        )
+
+    def match(self, face_encodings, threshold, k=MATCH_TOP_K):
+        """
+        Match every face of a frame at once.
+
+        Returns one (name, distance, margin) tuple per face. name is
+        None when the best distance is not below threshold; margin is
+        the gap to the closest sample of a different person among the
+        k nearest (a lower bound when all k belong to the same person).
+        """
+        if len(face_encodings) == 0:
+            return []
+
+        if len(self) == 0:
+            return [(None, np.inf, np.inf)] * len(face_encodings)
+
+        face_encodings = np.asarray(face_encodings, dtype=np.float32)
+        k = max(1, min(k, len(self)))
+        distances, ids = self.index.search(face_encodings, k)
+
+        # Ids are kept sorted, so rows can be found by bisection
+        rows = np.searchsorted(self.ids, np.maximum(ids, 0))
+        labels = np.where(ids >= 0, self.labels[rows], -1)
+
+        results = []
+        for q in range(len(distances)):
+            if ids[q, 0] < 0:
+                results.append((None, np.inf, np.inf))
+                continue
+
+            best = float(distances[q, 0])
+            others = np.nonzero(
+                (labels[q] != labels[q, 0]) & (ids[q] >= 0)
+            )[0]
+            if len(others):
+                margin = float(distances[q, others[0]]) - best
+            else:
+                margin = float(distances[q, -1]) - best
+
+            close_call = (
+                margin < self.rerank_margin
+                or abs(best - threshold) < self.rerank_margin
+            )
+            if self.samples is not None and close_call:
+                candidates = [
+                    self.identities[l]
+                    for l in dict.fromkeys(labels[q]) if l >= 0
+                ]
+                results.append(
+                    self._rerank(face_encodings[q], candidates, threshold)
+                )
                 continue
 
-        # User feedback when face detection is not ideal
-        cv2.putText(
-            display,
-            "Hold still, keep your face visible",
-            (20, 40),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.8,
-            (0, 0, 255),
-            2
+            name = self.names[rows[q, 0]] if best < threshold else None
+            results.append((name, best, margin))
+
+        return results
+
+    def _rerank(self, face_encoding, candidates, threshold):
+        """
+        Exact match of one face against all samples of a few people.
+        """
+        best = {
+            name: float(pairwise_distances(
+                face_encoding, self.samples[name]
+            ).min())
+            for name in candidates[:PROTOTYPE_RERANK_CANDIDATES]
+        }
+        ranked = sorted(best.items(), key=lambda item: item[1])
+
+        name, distance = ranked[0]
+        margin = ranked[1][1] - distance if len(ranked) > 1 else np.inf
+        return (name if distance < threshold else None, distance, margin)
+
+
+# ===================== FACE DETECTION =====================
+
+def _add_time(timings, stage, started):
+    """
+    Add the time since `started` to a stage total, if timing is on.
+    """
+    if timings is not None:
+        timings[stage] = (
+            timings.get(stage, 0.0) + time.perf_counter() - started
         )
-        cv2.imshow("Registration", display)
-        cv2.waitKey(1)
 
-        attempts += 1
 
-    cv2.destroyWindow("Registration")
+def _detect_in_region(frame, region, scale, timings=None):
+    """
+    Run the HOG detector on one (top, right, bottom, left) region of a
+    BGR frame at the given scale. Returns the RGB image searched, face
+    locations in it and the matching full-frame boxes.
+    """
+    top, right, bottom, left = region
+    crop = frame[top:bottom, left:right]
 
-    if saved >= samples:
-        print(f"[SUCCESS] Registration completed for {person_name}.")
-        return True
+    # Resize to trade speed against the smallest face that can be found
+    started = time.perf_counter()
+    if scale != 1:
+        crop = cv2.resize(crop, (0, 0), fx=scale, fy=scale)
+    _add_time(timings, "resize", started)
+
+    # Convert to RGB for face_recognition
+    started = time.perf_counter()
+    rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+    _add_time(timings, "convert", started)
+
+    # Detect face locations
+    started = time.perf_counter()
+    locations = face_recognition.face_locations(rgb, model="hog")
+    _add_time(timings, "detect", started)
+
+    boxes = [
+        (
+            top + int(t / scale), left + int(r / scale),
+            top + int(b / scale), left + int(l / scale)
+        )
+        for t, r, b, l in locations
+    ]
+    return rgb, locations, boxes
+
+
+def detect_and_encode(frame, scale=FRAME_RESIZE_SCALE, skip_boxes=(),
+                      iou_threshold=TRACK_IOU_THRESHOLD, regions=None,
+                      region_scale=None, timings=None):
+    """
+    Find faces in a BGR frame and encode them.
+
+    By default the whole frame is searched at `scale`. With `regions`,
+    only those (top, right, bottom, left) areas are searched, each at
+    region_scale (default: scale).
+
+    Returns full-frame (top, right, bottom, left) boxes and one encoding
+    per box. Faces overlapping one of skip_boxes are not encoded and get
+    None instead, so tracked faces keep their identity cheaply.
+
+    If a `timings` dict is given, seconds spent resizing, converting,
+    detecting and encoding are added to its "resize", "convert",
+    "detect" and "encode" entries.
+    """
+    if regions is None:
+        h, w = frame.shape[:2]
+        passes = [((0, w, h, 0), scale)]
     else:
-        print("[ERROR] Registration incomplete. Please retry in better lighting.")
-        return False
+        passes = [(region, region_scale or scale) for region in regions]
 
+    boxes = []
+    searched = []   # (rgb image, [(box index, location)]) per pass
 
-# ===================== UNKNOWN / INTRUDER HANDLING =====================
+    for region, region_scale in passes:
+        rgb, locations, found = _detect_in_region(
+            frame, region, region_scale, timings
+        )
 
-def save_unknown_face(frame, face_location, unknown_id):
-    os.makedirs(INTRUDER_SNAPSHOTS_DIR, exist_ok=True)
+        faces = []
+        for location, box in zip(locations, found):
+            # Regions may touch; keep each face once
+            if any(box_iou(box, other) >= iou_threshold for other in boxes):
+                continue
+            faces.append((len(boxes), location))
+            boxes.append(box)
+        searched.append((rgb, faces))
 
-    top, right, bottom, left = face_location
-    h, w = frame.shape[:2]
+    encodings = [None] * len(boxes)
 
-    if not (top < bottom and left < right and bottom <= h and right <= w):
-        return None
+    for rgb, faces in searched:
+        to_encode = [
+            (i, location) for i, location in faces
+            if not any(
+                box_iou(boxes[i], skip) >= iou_threshold
+                for skip in skip_boxes
+            )
+        ]
+        if not to_encode:
+            continue
 
-    face_img = frame[top:bottom, left:right]
-    if face_img.size == 0:
-        return None
+        started = time.perf_counter()
+        new = face_recognition.face_encodings(
+            rgb, [location for _, location in to_encode], num_jitters=1
+        )
+        _add_time(timings, "encode", started)
+        for (i, _), encoding in zip(to_encode, new):
+            encodings[i] = encoding
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    path = os.path.join(
-        INTRUDER_SNAPSHOTS_DIR,
-        f"{unknown_id}_{timestamp}.jpg"
-    )
+    return boxes, encodings
 
-    cv2.imwrite(path, face_img)
-    return path
@@ -0,0 +1,440 @@
+import os
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from metrics_utils import metrics
+from config import (
+    FRAME_WIDTH,
+    FRAME_HEIGHT,
+    CAMERA_RECONNECT_DELAY,
+    CAMERA_RECONNECT_MAX_DELAY,
+    CAMERA_READ_TIMEOUT,
+    MOTION_WIDTH,
+    MOTION_PIXEL_DELTA,
+    MOTION_MIN_AREA
+)
+
+
+# ===================== SHARED FRAME RING =====================
+
+class FrameRing:
+    """
+    Fixed ring of preallocated frames in shared memory.
+
+    The capture loop decodes straight into a free slot and commits it
+    with an increasing sequence number; the newest committed slot is
+    the "latest" frame (older ones are simply overwritten later).
+    Display and recognition read slots in place, in this or any other
+    process, without copying or allocating per frame.
+
+    Readers in the owning process pin a slot while they use it and
+    the writer never reuses a pinned slot. Other processes can check
+    the slot's sequence number to make sure it wasn't overwritten.
+    The owning process also knows when each slot was captured.
+    """
+
+    def __init__(self, shape, slots, name=None, create=True):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frame_bytes = int(np.prod(self.shape))
+
+        # Header: one sequence number per slot, then latest slot and seq
+        header_bytes = 8 * (slots + 2)
+        size = header_bytes + self.frame_bytes * slots
+
+        if create:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        elif sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            # Pool workers share the creator's resource tracker
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = create
+
+        self.header = np.ndarray(
+            slots + 2, dtype=np.int64, buffer=self.shm.buf
+        )
+        self.frames = [
+            np.ndarray(
+                self.shape, dtype=np.uint8, buffer=self.shm.buf,
+                offset=header_bytes + i * self.frame_bytes
+            )
+            for i in range(slots)
+        ]
+
+        if create:
+            self.header[:slots] = -1
+            self.header[slots] = -1
+            self.header[slots + 1] = -1
+
+        # Pins and capture times are only tracked in the creating process
+        self.pins = [0] * slots
+        self.stamps = [0.0] * slots
+        self.lock = threading.Lock()
+        self._next_seq = 0
+        self._cursor = 0
+
+    @classmethod
+    def attach(cls, name, shape, slots):
+        """
+        Open a ring created by another process.
+        """
+        return cls(shape, slots, name=name, create=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def view(self, slot):
+        return self.frames[slot]
+
+    def seq(self, slot):
+        return int(self.header[slot])
+
+    # ----- writer -----
+
+    def acquire(self):
+        """
+        Pick the next slot the writer may fill, skipping pinned slots
+        and the latest frame. Returns None if every slot is in use.
+        """
+        latest = int(self.header[self.slots])
+
+        with self.lock:
+            for step in range(self.slots):
+                slot = (self._cursor + step) % self.slots
+                if self.pins[slot] == 0 and slot != latest:
+                    self._cursor = (slot + 1) % self.slots
+                    # Invalidate the old contents before overwriting them
+                    self.header[slot] = -1
+                    return slot
+
+        return None
+
+    def commit(self, slot, captured=None):
+        """
+        Publish a filled slot as the latest frame; returns its sequence
+        number. `captured` is the time.monotonic() the frame was read.
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+
+        self.stamps[slot] = time.monotonic() if captured is None else captured
+        self.header[slot] = seq
+        self.header[self.slots + 1] = seq
+        self.header[self.slots] = slot
+        return seq
+
+    # ----- readers -----
+
+    def latest(self, pin=True):
+        """
+        Return (seq, slot) of the newest frame, or (-1, None) before the
+        first commit. With pin=True the caller must unpin(slot) afterwards.
+        """
+        with self.lock:
+            slot = int(self.header[self.slots])
+            if slot < 0:
+                return -1, None
+            if pin:
+                self.pins[slot] += 1
+            return int(self.header[slot]), slot
+
+    def age(self, slot, now=None):
+        """
+        Seconds since the frame in a slot was captured.
+        """
+        now = time.monotonic() if now is None else now
+        return now - self.stamps[slot]
+
+    def pin(self, slot):
+        with self.lock:
+            self.pins[slot] += 1
+
+    def unpin(self, slot):
+        with self.lock:
+            self.pins[slot] -= 1
+
+    def close(self):
+        # Views must go before the buffer can be released
+        self.frames = []
+        self.header = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# ===================== CAMERA CAPTURE =====================
+
+class CameraStream:
+    """
+    One named camera, decoded by its own thread into its own FrameRing.
+
+    The thread reads as fast as the source delivers and only the newest
+    frame is ever "latest", so slow consumers skip frames instead of
+    falling behind a stream's buffer. Live sources (camera indexes and
+    URLs) that stop delivering are reopened with a growing delay
+    between attempts; a video file simply ends.
+    """
+
+    def __init__(self, name, source, slots, width=FRAME_WIDTH,
+                 height=FRAME_HEIGHT, notify=None,
+                 reconnect_delay=CAMERA_RECONNECT_DELAY,
+                 reconnect_max_delay=CAMERA_RECONNECT_MAX_DELAY):
+        self.name = name
+        self.source = source
+        self.slots = slots
+        self.width = width
+        self.height = height
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.live = not (isinstance(source, str) and os.path.isfile(source))
+
+        # Set after every committed frame, e.g. to wake a dispatcher
+        self.notify = notify
+
+        self.cap = None
+        self.ring = None
+        self.fps = 0
+        self.running = False
+        self.connected = False
+        self._thread = None
+        self._stop = threading.Event()
+
+        metrics.gauge("capture_fps", lambda: self.fps, camera=name)
+        metrics.gauge(
+            "camera_connected", lambda: int(self.connected), camera=name
+        )
+
+    def _connect(self):
+        if isinstance(self.source, str) and self.live:
+            # Stalled network streams fail a read instead of hanging
+            timeout_ms = int(CAMERA_READ_TIMEOUT * 1000)
+            cap = cv2.VideoCapture(self.source, cv2.CAP_ANY, [
+                cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms,
+                cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms
+            ])
+        else:
+            cap = cv2.VideoCapture(self.source)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        # Keep OpenCV's own queue short so a read returns a recent frame
+        # (not every backend honours this; the capture thread drains
+        # the rest anyway)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def open(self):
+        """
+        Open the source and size the frame ring from its first frame.
+        """
+        self.cap = self._connect()
+
+        ret, first = self.cap.read()
+        if not self.cap.isOpened() or not ret:
+            self.cap.release()
+            return False
+
+        if self.ring is None:
+            self.ring = FrameRing(first.shape, self.slots)
+        self.connected = True
+        return True
+
+    def start(self):
+        self._stop.clear()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        ring = self.ring
+        height, width = ring.shape[:2]
+
+        fps_counter = 0
+        fps_timer = time.monotonic()
+
+        while not self._stop.is_set():
+            slot = ring.acquire()
+            if slot is None:
+                # Every slot is pinned (ring configured too small)
+                self.cap.grab()
+                metrics.inc(
+                    "frames_dropped", camera=self.name, reason="ring_full"
+                )
+                continue
+            target = ring.view(slot)
+
+            ret, frame = self.cap.read(target)
+            if not ret:
+                if not self.live or not self._reconnect():
+                    if not self._stop.is_set():
+                        print(
+                            f"[ERROR] Camera '{self.name}' stopped "
+                            f"delivering frames"
+                        )
+                    break
+                fps_counter = 0
+                fps_timer = time.monotonic()
+                continue
+            captured = time.monotonic()
+
+            # OpenCV only decodes in place when the size matches the slot
+            if frame is not target:
+                if frame.shape == target.shape:
+                    np.copyto(target, frame)
+                else:
+                    cv2.resize(frame, (width, height), dst=target)
+
+            ring.commit(slot, captured)
+            if self.notify is not None:
+                self.notify.set()
+            metrics.inc("frames_captured", camera=self.name)
+
+            # Update FPS every second
+            fps_counter += 1
+            if captured - fps_timer >= 1:
+                self.fps = fps_counter
+                fps_counter = 0
+                fps_timer = captured
+
+        self.connected = False
+        self.running = False
+
+    def _reconnect(self):
+        """
+        Reopen a dropped live stream, doubling the wait after every
+        failed attempt. Returns False if stopped first.
+        """
+        print(f"[ERROR] Camera '{self.name}' dropped; reconnecting")
+        self.connected = False
+        self.fps = 0
+        self.cap.release()
+
+        delay = self.reconnect_delay
+        while not self._stop.wait(delay):
+            metrics.inc("camera_reconnects", camera=self.name)
+            cap = self._connect()
+            if cap.isOpened() and cap.grab():
+                self.cap = cap
+                self.connected = True
+                print(f"[INFO] Camera '{self.name}' reconnected")
+                return True
+
+            cap.release()
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+        return False
+
+    def stop(self):
+        """
+        Stop capturing and release the device (the ring is kept).
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if self.cap is not None:
+            self.cap.release()
+        self.running = False
+
+    def close(self):
+        self.stop()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+# ===================== MOTION DETECTION =====================
+
+class MotionDetector:
+    """
+    Cheap change detection for one camera: each frame is shrunk to a
+    small grey image and compared with a running-average background,
+    so slow movement adds up instead of hiding between two frames.
+    All buffers are allocated once.
+    """
+
+    # How fast the background absorbs changes (0..1 per frame)
+    BACKGROUND_RATE = 0.05
+
+    def __init__(self, width=MOTION_WIDTH, pixel_delta=MOTION_PIXEL_DELTA,
+                 min_area=MOTION_MIN_AREA):
+        self.width = width
+        self.pixel_delta = pixel_delta
+        self.min_area = min_area
+
+        self.size = None
+        self.background = None
+        self.changed = 0.0
+
+    def _allocate(self, frame):
+        h, w = frame.shape[:2]
+        self.size = (self.width, max(1, round(h * self.width / w)))
+        shape = self.size[::-1]
+
+        self.small = np.empty(shape + frame.shape[2:], dtype=np.uint8)
+        self.grey = np.empty(shape, dtype=np.uint8)
+        self.grey_f = np.empty(shape, dtype=np.float32)
+        self.diff = np.empty(shape, dtype=np.float32)
+        self.mask = np.empty(shape, dtype=np.uint8)
+
+    def update(self, frame):
+        """
+        Compare a frame with the background. Returns True on motion;
+        the first frame always counts as motion.
+        """
+        if self.size is None:
+            self._allocate(frame)
+
+        cv2.resize(
+            frame, self.size, dst=self.small, interpolation=cv2.INTER_AREA
+        )
+        if self.small.ndim == 3:
+            cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.grey)
+        else:
+            np.copyto(self.grey, self.small)
+        # Smooth out sensor noise
+        cv2.GaussianBlur(self.grey, (5, 5), 0, dst=self.grey)
+
+        if self.background is None:
+            self.background = self.grey.astype(np.float32)
+            self.mask.fill(255)
+            self.changed = 1.0
+            return True
+
+        np.copyto(self.grey_f, self.grey)
+        cv2.absdiff(self.grey_f, self.background, dst=self.diff)
+        cv2.compare(self.diff, self.pixel_delta, cv2.CMP_GT, dst=self.mask)
+        self.changed = cv2.countNonZero(self.mask) / self.mask.size
+
+        cv2.accumulateWeighted(
+            self.grey_f, self.background, self.BACKGROUND_RATE
+        )
+        return self.changed >= self.min_area
+
+    def regions(self, shape, min_pixels=4):
+        """
+        Bounding boxes of the areas that changed in the last frame,
+        as (top, right, bottom, left) in a frame of the given shape.
+        Specks smaller than min_pixels (in the small image) are ignored.
+        """
+        if self.size is None:
+            return []
+
+        count, _, stats, _ = cv2.connectedComponentsWithStats(self.mask)
+        fy = shape[0] / self.mask.shape[0]
+        fx = shape[1] / self.mask.shape[1]
+
+        boxes = []
+        # Component 0 is the unchanged background
+        for x, y, w, h, area in stats[1:count]:
+            if area < min_pixels:
+                continue
+            boxes.append((
+                int(y * fy), int((x + w) * fx), int((y + h) * fy), int(x * fx)
+            ))
+        return boxes
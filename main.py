@@ -1,22 +1,25 @@
+import argparse
 import cv2
-import face_recognition
+import numpy as np
 import os
+import re
+import signal
 import time
 import threading
-import queue
-from datetime import datetime
 
 from config import *
-from face_utils import (
-    load_known_faces,
-    recognize_face,
-    register_new_person,
-    save_unknown_face
+from face_utils import Gallery
+from pipeline_utils import (
+    RecognitionPipeline,
+    RecognitionPool,
+    FrameDispatcher,
+    ring_slots
 )
-from tracking_utils import PersonTracker
-from db_utils import init_db, create_session, update_exit
-
-print("[INFO] IPMAS is starting up...")
+from frame_utils import CameraStream
+from registration_utils import valid_person_name
+from db_utils import init_db, AttendanceWriter
+from snapshot_utils import SnapshotWriter
+from metrics_utils import metrics, start_exporters
 
 # ===================== DISPLAY SETTINGS =====================
 
@@ -24,231 +27,349 @@ print("[INFO] IPMAS is starting up...")
 TARGET_FPS = 30
 FRAME_DELAY = int(1000 / TARGET_FPS)
 
-# ===================== INITIAL SETUP =====================
+# How long the result of a registration stays on screen
+REGISTER_STATUS_SECONDS = 5
 
-# Make sure required folders exist
-os.makedirs("data", exist_ok=True)
-os.makedirs(UNKNOWN_FACES_DIR, exist_ok=True)
-os.makedirs(INTRUDER_SNAPSHOTS_DIR, exist_ok=True)
+# Keys for typing a name into the camera window
+KEY_ENTER = (10, 13)
+KEY_BACKSPACE = (8, 127)
+KEY_ESC = 27
 
-# Initialize database
-init_db(DATABASE_PATH)
+# ===================== FACE RECOGNITION THREAD =====================
 
-# Load known faces from disk
-known_encodings, known_names = load_known_faces(KNOWN_FACES_DIR)
+def recognition_consumer(pool, pipeline):
+    """
+    Apply worker results in capture order. This thread is the only
+    one that touches the tracker and the database.
+    """
+    for result in pool.results():
+        try:
+            pipeline.process(
+                result.frame, result.boxes, result.encodings, result.camera
+            )
+        finally:
+            pool.release(result)
 
-# Tracker keeps track of who enters and exits
-tracker = PersonTracker()
+        now = time.monotonic()
+        latency = now - result.submitted
+        pipeline.latency_ms = int(latency * 1000)
+        metrics.observe("recognition_latency", latency, camera=result.camera)
 
-# Open camera / video source
-cap = cv2.VideoCapture(VIDEO_SOURCE)
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        # Camera to attendance event: how old the frame was when applied
+        age = now - result.captured
+        pipeline.frame_age_ms = int(age * 1000)
+        metrics.observe("frame_age", age, camera=result.camera)
 
-if not cap.isOpened():
-    print("[ERROR] Unable to access camera")
-    exit()
 
-# ===================== THREADING VARIABLES =====================
+# ===================== DISPLAY =====================
 
-# Queue holds the latest frame for recognition
-frame_queue = queue.Queue(maxsize=1)
+def draw_camera(display, frame, tracks, fps, latency_ms, age_ms,
+                status=None):
+    """
+    Copy a camera frame into its display buffer and draw the overlays.
+    """
+    np.copyto(display, frame)
 
-# Shared data between threads
-latest_results = []
-unknown_counter = 0
-latency_ms = 0
+    # Draw tracked faces, moved to where they are in this frame
+    for name, (top, right, bottom, left) in tracks.predict(frame):
+        color = (0, 255, 0) if not name.startswith("UNKNOWN") else (0, 0, 255)
 
-# ===================== FACE RECOGNITION THREAD =====================
+        cv2.rectangle(display, (left, top), (right, bottom), color, 2)
+        cv2.putText(
+            display,
+            name,
+            (left, top - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            color,
+            2
+        )
 
-def recognition_worker():
-    global latest_results, unknown_counter, latency_ms
+    # Show performance details
+    cv2.putText(
+        display,
+        f"FPS: {fps} | Recognition: {latency_ms} ms | Age: {age_ms} ms",
+        (10, 30),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.7,
+        (0, 255, 255),
+        2
+    )
 
-    while True:
-        frame = frame_queue.get()
-        if frame is None:
-            break
+    # Registration prompt or progress
+    if status:
+        cv2.putText(
+            display,
+            status,
+            (10, 60),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.7,
+            (255, 255, 0),
+            2
+        )
 
-        start_time = time.time()
 
-        # Resize frame to improve recognition speed
-        small = cv2.resize(
-            frame, (0, 0),
-            fx=FRAME_RESIZE_SCALE,
-            fy=FRAME_RESIZE_SCALE
-        )
+def registration_status(pipeline, camera, typing):
+    """
+    Overlay line for a camera: the name being typed, or the progress
+    of a registration on it (and its result for a few seconds).
+    """
+    if typing is not None:
+        return f"Register name: {typing}_ (Enter to start, Esc to cancel)"
 
-        # Convert to RGB for face_recognition
-        rgb_small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    job = pipeline.registration
+    if job is None or job.camera != camera:
+        return None
+    if job.finished and time.monotonic() - job.ended > REGISTER_STATUS_SECONDS:
+        return None
+    return job.status()
 
-        # Detect face locations
-        locations = face_recognition.face_locations(
-            rgb_small, model="hog"
-        )
 
-        # Extract face encodings
-        encodings = face_recognition.face_encodings(
-            rgb_small, locations, num_jitters=1
-        )
+def edit_name(name, key):
+    """
+    Apply one key press to a name being typed. Only characters that
+    are safe in a folder name are accepted.
+    """
+    if key in KEY_BACKSPACE:
+        return name[:-1]
+    char = chr(key)
+    if char.isalnum() or char in " _-.":
+        return name + char
+    return name
 
-        results = []
-        detected_now = set()
 
-        for encoding, loc in zip(encodings, locations):
-            top, right, bottom, left = [
-                int(v / FRAME_RESIZE_SCALE) for v in loc
-            ]
+# ===================== MAIN CAMERA LOOP =====================
 
-            # Try to match face with known people
-            name = recognize_face(
-                encoding,
-                known_encodings,
-                known_names,
-                FACE_MATCH_THRESHOLD
+def run_display(cameras, pipeline, stop):
+    """
+    Show every camera with overlays until 'q', a stop request, or all
+    cameras ending. 'r' registers a new person with the first camera:
+    the name is typed into the window, then samples are taken from the
+    live stream while monitoring carries on.
+    """
+    # Overlays are drawn on reused buffers, never on the shared frames
+    displays = {c.name: np.empty(c.ring.shape, dtype=np.uint8) for c in cameras}
+    shown = {c.name: -1 for c in cameras}
+
+    # Name being typed after 'r' (None: not typing)
+    typing = None
+
+    print("[INFO] Press 'q' to quit | Press 'r' to register a new face")
+
+    while not stop.is_set() and any(camera.running for camera in cameras):
+        for camera in cameras:
+            seq, slot = camera.ring.latest()
+            if slot is None:
+                continue
+
+            status = registration_status(
+                pipeline, camera.name,
+                typing if camera is cameras[0] else None
             )
 
-            # Handle unknown faces
-            if name is None:
-                unknown_id = tracker.identify_unknown(
-                    encoding, FACE_MATCH_THRESHOLD
+            try:
+                # Only redraw when the camera produced a new frame,
+                # or while a registration overlay may be changing
+                if seq == shown[camera.name] and status is None:
+                    continue
+                shown[camera.name] = seq
+
+                draw_camera(
+                    displays[camera.name],
+                    camera.ring.view(slot),
+                    pipeline.tracks_for(camera.name),
+                    camera.fps,
+                    pipeline.latency_ms,
+                    pipeline.frame_age_ms,
+                    status
                 )
+            finally:
+                camera.ring.unpin(slot)
+
+            cv2.imshow(f"IPMAS - {camera.name}", displays[camera.name])
+
+        key = cv2.waitKey(FRAME_DELAY) & 0xFF
+        if key == 0xFF:
+            continue
+
+        if typing is not None:
+            if key in KEY_ENTER:
+                name = typing.strip()
+                if valid_person_name(name):
+                    typing = None
+                    pipeline.start_registration(name, cameras[0].name)
+                else:
+                    # Keep the prompt open to fix the name
+                    print(f"[ERROR] '{name}' can't be used as a name")
+            elif key == KEY_ESC:
+                typing = None
+            else:
+                typing = edit_name(typing, key)
+
+        elif key == ord('q'):
+            break
 
-                if unknown_id is None:
-                    unknown_id = f"UNKNOWN_{unknown_counter}"
-                    tracker.add_unknown(encoding, unknown_id)
-                    unknown_counter += 1
+        elif key == ord('r'):
+            typing = ""
 
-                    # Save unknown face safely
-                    h, w = frame.shape[:2]
-                    if top < bottom and left < right and bottom <= h and right <= w:
-                        save_unknown_face(
-                            frame, (top, right, bottom, left), unknown_id
-                        )
+        elif key == KEY_ESC:
+            pipeline.cancel_registration()
 
-                name = unknown_id
+    cv2.destroyAllWindows()
 
-            # Final safety check
-            if not name or name.strip() == "":
-                name = "Unknown"
 
-            detected_now.add(name)
+def run_headless(cameras, stop):
+    """
+    No windows or overlays: capture and recognition run on their own
+    threads as fast as the sources allow; just wait for the end.
+    """
+    print("[INFO] Running headless | Send SIGTERM or press Ctrl+C to stop")
 
-            # Track entry and exit events
-            state = tracker.seen(name)
+    while not stop.is_set() and any(camera.running for camera in cameras):
+        stop.wait(0.5)
 
-            if state == "ENTER":
-                create_session(
-                    DATABASE_PATH, name, datetime.now().isoformat()
-                )
 
-            elif isinstance(state, tuple):
-                update_exit(
-                    DATABASE_PATH,
-                    name,
-                    datetime.now().isoformat(),
-                    state[1]
-                )
+# ===================== COMMAND LINE =====================
 
-            results.append((name, (top, right, bottom, left)))
+def parse_sources(specs):
+    """
+    Turn NAME=SOURCE arguments into a camera dict; numeric sources are
+    local camera indexes. A source given without a plain name (e.g. a
+    URL with "=" in its query) is named after its position.
+    """
+    sources = {}
+    for i, spec in enumerate(specs):
+        name, sep, source = spec.partition("=")
+        if not sep or not re.fullmatch(r"[\w.-]+", name):
+            name, source = f"camera{i}", spec
+        sources[name] = int(source) if source.isdigit() else source
+    return sources
 
-        # Check for people who left the frame
-        for pid in list(tracker.state.keys()):
-            if pid not in detected_now:
-                tracker.check_exit(pid, EXIT_TIMEOUT_SECONDS)
 
-        latency_ms = int((time.time() - start_time) * 1000) 
-        latest_results = results
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="IPMAS live face recognition and attendance"
+    )
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="Run without windows or overlays (e.g. as a service)"
+    )
+    parser.add_argument(
+        "--source", action="append", metavar="NAME=SOURCE",
+        help="Camera to open, repeatable; replaces VIDEO_SOURCES"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=RECOGNITION_WORKERS,
+        help="Recognition worker processes (0 = one per spare core)"
+    )
+    parser.add_argument("--db", default=DATABASE_PATH)
+    parser.add_argument(
+        "--metrics-port", type=int, default=METRICS_PORT,
+        help="Serve Prometheus metrics on this port (0 = off)"
+    )
+    return parser
 
 
-# Start recognition in background thread
-threading.Thread(
-    target=recognition_worker,
-    daemon=True
-).start()
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    print("[INFO] IPMAS is starting up...")
 
-print("[INFO] Press 'q' to quit | Press 'r' to register a new face")
+    # SIGTERM (service stop) and Ctrl+C end the run through the normal
+    # cleanup, so queued attendance events are still committed
+    stop = threading.Event()
 
-# ===================== MAIN CAMERA LOOP =====================
+    def request_stop(signum, frame):
+        print(f"[INFO] Received {signal.Signals(signum).name}, shutting down")
+        stop.set()
 
-frame_count = 0
-fps_counter = 0
-fps = 0
-fps_timer = time.time()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
+    # Make sure required folders exist
+    os.makedirs("data", exist_ok=True)
+    os.makedirs(UNKNOWN_FACES_DIR, exist_ok=True)
+    os.makedirs(INTRUDER_SNAPSHOTS_DIR, exist_ok=True)
 
-    frame_count += 1
-    fps_counter += 1
+    # Initialize database
+    init_db(args.db)
 
-    # Update FPS every second
-    if time.time() - fps_timer >= 1:
-        fps = fps_counter
-        fps_counter = 0
-        fps_timer = time.time()
+    # Prometheus endpoint and/or JSON log, if configured
+    exporters = start_exporters(port=args.metrics_port)
 
-    # Send frame to recognition thread when allowed
-    if frame_count % FRAME_SKIP == 0 and frame_queue.empty():
-        frame_queue.put(frame.copy())
+    # One background connection commits attendance events in batches
+    writer = AttendanceWriter(args.db)
 
-    display = frame.copy()
+    # Crops of unknown faces are encoded and saved off the recognition path
+    snapshots = SnapshotWriter() if ALERT_UNKNOWN else None
 
-    # Draw last known recognition results
-    for name, (top, right, bottom, left) in latest_results:
-        color = (0, 255, 0) if not name.startswith("UNKNOWN") else (0, 0, 255)
+    # Load known faces from disk
+    pipeline = RecognitionPipeline(
+        Gallery.load(KNOWN_FACES_DIR), writer, snapshots
+    )
 
-        cv2.rectangle(display, (left, top), (right, bottom), color, 2)
-        cv2.putText(
-            display,
-            name,
-            (left, top - 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.8,
-            color,
-            2
+    # Open every camera; each decodes into its own shared frame ring
+    sources = parse_sources(args.source) if args.source else VIDEO_SOURCES
+    new_frame = threading.Event()
+    cameras = []
+    for name, source in sources.items():
+        camera = CameraStream(
+            name, source, ring_slots(args.workers), notify=new_frame
         )
+        if camera.open():
+            cameras.append(camera)
+        else:
+            print(f"[ERROR] Unable to access camera '{name}'")
+
+    pool = dispatcher = consumer = None
+    try:
+        if not cameras:
+            return
+
+        # Detection and encoding run in worker processes shared by all cameras
+        pool = RecognitionPool(args.workers)
+        print(f"[INFO] Started {pool.workers} recognition workers")
+
+        consumer = threading.Thread(
+            target=recognition_consumer,
+            args=(pool, pipeline),
+            daemon=True
+        )
+        consumer.start()
 
-    # Show performance details
-    cv2.putText(
-        display,
-        f"FPS: {fps} | Recognition Time: {latency_ms} ms",
-        (10, 30),
-        cv2.FONT_HERSHEY_SIMPLEX,
-        0.7,
-        (0, 255, 255),
-        2
-    )
-
-    cv2.imshow("IPMAS - Live Camera Feed", display)
+        dispatcher = FrameDispatcher(cameras, pool, pipeline, new_frame)
+        dispatcher.start()
 
-    key = cv2.waitKey(FRAME_DELAY) & 0xFF
+        for camera in cameras:
+            camera.start()
 
-    if key == ord('q'):
-        break
+        if args.headless:
+            run_headless(cameras, stop)
+        else:
+            run_display(cameras, pipeline, stop)
 
-    elif key == ord('r'):
-        cap.release()
-        cv2.destroyAllWindows()
+    finally:
+        # ===================== CLEANUP =====================
 
-        person = input("Enter the person's name to register: ").strip()
-        cap = cv2.VideoCapture(VIDEO_SOURCE)
-        time.sleep(1)
+        for camera in cameras:
+            camera.stop()
+        if dispatcher is not None:
+            dispatcher.stop()
+        if pool is not None:
+            pool.close()
+        if consumer is not None:
+            consumer.join(timeout=5)
 
-        success = register_new_person(
-            cap,
-            KNOWN_FACES_DIR,
-            person
-        )
+        # Commit whatever the recognizer queued last
+        writer.close()
+        if snapshots is not None:
+            snapshots.close()
+        for exporter in exporters:
+            exporter.close()
 
-        if success is not False:
-            known_encodings, known_names = load_known_faces(KNOWN_FACES_DIR)
-            print("[INFO] Face data updated successfully")
+        for camera in cameras:
+            camera.close()
+        print("[INFO] IPMAS has been shut down safely")
 
-# ===================== CLEANUP =====================
 
-frame_queue.put(None)
-cap.release()
-cv2.destroyAllWindows()
-print("[INFO] IPMAS has been shut down safely")
+if __name__ == "__main__":
+    main()
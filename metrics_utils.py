@@ -0,0 +1,285 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_PORT, METRICS_LOG_PATH, METRICS_LOG_INTERVAL
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+TIMER_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+
+
+# ===================== METRICS REGISTRY =====================
+
+class Timer:
+    """
+    Latency histogram of one stage: count, sum and cumulative buckets.
+    """
+
+    __slots__ = ("count", "total", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(TIMER_BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(TIMER_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class Metrics:
+    """
+    In-process registry of stage timers, event counters and gauges.
+
+    Every metric may carry labels (e.g. camera="main"). Updates take a
+    short lock, so they are cheap enough for every frame. Gauges are
+    read from callbacks only when the metrics are exported.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+
+    @staticmethod
+    def _key(name, labels):
+        # Unset labels (e.g. camera=None) are left out, so every key
+        # sorts and exports the same way
+        return name, tuple(sorted(
+            (k, v) for k, v in labels.items() if v is not None
+        ))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = Timer()
+            timer.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def gauge(self, name, read, **labels):
+        """
+        Register a callback returning the current value, e.g. a queue size.
+        """
+        with self.lock:
+            self.gauges[self._key(name, labels)] = read
+
+    def snapshot(self):
+        """
+        All current values as a JSON-friendly dict.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {
+                key: (t.count, t.total) for key, t in self.timers.items()
+            }
+            gauges = dict(self.gauges)
+
+        def label(key):
+            name, labels = key
+            if not labels:
+                return name
+            return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+        return {
+            "time": time.time(),
+            "counters": {label(k): v for k, v in counters.items()},
+            "gauges": {label(k): _read(read) for k, read in gauges.items()},
+            "timers": {
+                label(k): {
+                    "count": count,
+                    "mean_ms": total / count * 1000 if count else 0.0,
+                }
+                for k, (count, total) in timers.items()
+            },
+        }
+
+    def prometheus(self):
+        """
+        All current values in the Prometheus text exposition format.
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(
+                (key, t.count, t.total, list(t.buckets))
+                for key, t in self.timers.items()
+            )
+            gauges = sorted(self.gauges.items(), key=lambda item: item[0])
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            name = f"ipmas_{name}_total"
+            declare(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), read in gauges:
+            name = f"ipmas_{name}"
+            declare(name, "gauge")
+            lines.append(f"{name}{_labels(labels)} {_read(read)}")
+
+        for (name, labels), count, total, buckets in timers:
+            name = f"ipmas_{name}_seconds"
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, hits in zip(TIMER_BUCKETS, buckets):
+                cumulative += hits
+                le = labels + (("le", bound),)
+                lines.append(f"{name}_bucket{_labels(le)} {cumulative}")
+            le = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{_labels(le)} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _read(read):
+    try:
+        return read()
+    except Exception:
+        # A gauge whose owner is gone reads as empty
+        return 0
+
+
+# Shared by every module of this process
+metrics = Metrics()
+
+
+# ===================== EXPORT =====================
+
+class MetricsServer:
+    """
+    Serves the metrics at http://<host>:<port>/metrics for Prometheus.
+    """
+
+    def __init__(self, port=METRICS_PORT, host="127.0.0.1",
+                 registry=metrics):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4"
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # Scrapes every few seconds would flood the console
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        print(f"[INFO] Metrics served on http://127.0.0.1:{self.port}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsLogger:
+    """
+    Appends a JSON snapshot of the metrics to a file every `interval`
+    seconds (one object per line).
+    """
+
+    def __init__(self, path=METRICS_LOG_PATH, interval=METRICS_LOG_INTERVAL,
+                 registry=metrics):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(self.registry.snapshot()) + "\n")
+        except OSError as e:
+            print(f"[ERROR] Failed to write metrics log: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+        # Keep the final numbers of the run
+        self.write()
+
+
+def start_exporters(port=METRICS_PORT, log_path=METRICS_LOG_PATH,
+                    interval=METRICS_LOG_INTERVAL):
+    """
+    Start whichever exporters are configured; returns them for close().
+    """
+    exporters = []
+
+    if port:
+        try:
+            server = MetricsServer(port)
+            server.start()
+            exporters.append(server)
+        except OSError as e:
+            print(f"[ERROR] Could not serve metrics on port {port}: {e}")
+
+    if log_path:
+        logger = MetricsLogger(log_path, interval)
+        logger.start()
+        exporters.append(logger)
+
+    return exporters
@@ -0,0 +1,821 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from config import (
+    FACE_MATCH_THRESHOLD,
+    EXIT_TIMEOUT_SECONDS,
+    RECOGNITION_WORKERS,
+    RECOGNITION_FRAMES_PER_WORKER,
+    RECOGNITION_RESULT_TIMEOUT,
+    FRAME_RING_SLOTS,
+    MAX_FRAME_AGE,
+    FRAME_SKIP,
+    FRAME_RESIZE_SCALE,
+    ACTIVE_RESIZE_SCALE,
+    MOTION_HOLD_SECONDS,
+    IDLE_RECOGNITION_SECONDS,
+    RECOGNITION_CPU_BUDGET,
+    ROI_DETECTION,
+    ROI_RESIZE_SCALE,
+    ROI_TRACK_PADDING,
+    ROI_MOTION_PADDING,
+    ROI_MIN_SIZE,
+    ROI_FULL_SWEEP_SECONDS
+)
+from face_utils import detect_and_encode
+from frame_utils import FrameRing, MotionDetector
+from snapshot_utils import crop_face
+from metrics_utils import metrics
+from registration_utils import RegistrationJob
+from tracking_utils import (
+    UNKNOWN_PREFIX,
+    PersonTracker,
+    FaceTrackManager,
+    expand_box,
+    merge_boxes
+)
+
+
+# ===================== RECOGNITION OWNER =====================
+
+class RecognitionPipeline:
+    """
+    Owner of all recognition state: gallery, person tracker,
+    face tracks and database updates.
+
+    Detection and encoding may happen anywhere (worker processes);
+    their results must be applied here, one frame at a time and in
+    capture order, so entry/exit events stay consistent.
+    """
+
+    def __init__(self, gallery, writer, snapshots=None,
+                 threshold=FACE_MATCH_THRESHOLD):
+        # Replaced wholesale on registration; read once per frame
+        self.gallery = gallery
+        self.threshold = threshold
+
+        # Queues attendance events; disk I/O happens on its own thread
+        self.writer = writer
+
+        # Saves crops of unknown faces in the background (None: don't)
+        self.snapshots = snapshots
+
+        # Tracker keeps track of who enters and exits
+        self.tracker = PersonTracker(EXIT_TIMEOUT_SECONDS)
+
+        # Face tracks carry identities between frames, per camera
+        self.face_tracks = {}
+        self.lock = threading.Lock()
+
+        # Live registration in progress (or the last one, for its status)
+        self.registration = None
+
+        self.unknown_counter = 0
+        self.latency_ms = 0
+        # Capture-to-result time of the latest processed frame
+        self.frame_age_ms = 0
+
+    def tracks_for(self, camera):
+        """
+        Face tracks of one camera (boxes are in that camera's frame).
+        """
+        with self.lock:
+            tracks = self.face_tracks.get(camera)
+            if tracks is None:
+                tracks = self.face_tracks[camera] = FaceTrackManager()
+            return tracks
+
+    def skip_boxes(self, camera=None):
+        """
+        Boxes whose faces don't need encoding in the camera's next frame.
+        """
+        job = self.registration
+        if job is not None and not job.finished and job.camera == camera:
+            # Registration needs an encoding of every frame it samples
+            return ()
+        return self.tracks_for(camera).stable_boxes()
+
+    def start_registration(self, name, camera):
+        """
+        Register a person from the camera's stream while recognition
+        goes on; replaces a registration still in progress.
+        """
+        with self.lock:
+            old = self.registration
+            if old is not None and not old.finished:
+                print(f"[INFO] Registration of {old.name} cancelled")
+            self.registration = RegistrationJob(name, camera)
+            print(f"[INFO] Registering {name} on camera '{camera}'")
+            return self.registration
+
+    def cancel_registration(self):
+        with self.lock:
+            job = self.registration
+            if job is not None and not job.finished:
+                job.cancel()
+                print(f"[INFO] Registration of {job.name} cancelled")
+
+    def _sample_registration(self, frame, boxes, encodings, camera, now):
+        """
+        Offer the frame to the registration in progress; publish the
+        new person once it has enough samples.
+        """
+        job = self.registration
+        if job is None or job.finished or job.camera != camera:
+            return
+
+        job.offer(frame, boxes, encodings, now)
+        if job.state == "done":
+            # Matched from the next frame on; files are written meanwhile
+            self.gallery = self.gallery.add_person(job.name, job.encodings)
+            job.save()
+        elif job.state == "failed":
+            print(f"[ERROR] {job.status()}")
+
+    def process(self, frame, boxes, encodings, camera=None):
+        """
+        Apply the detections of one frame from the given camera.
+        encodings[i] is None for faces the detector skipped because
+        they are already tracked.
+        """
+        # Take one snapshot so a registration in progress can't tear it
+        gallery = self.gallery
+        face_tracks = self.tracks_for(camera)
+        now = time.monotonic()
+
+        self._sample_registration(frame, boxes, encodings, camera, now)
+
+        started = time.perf_counter()
+        track_ids = face_tracks.associate(boxes, now)
+        track_seconds = time.perf_counter() - started
+
+        # Match all new encodings against known people in one batch
+        encoded = [i for i, e in enumerate(encodings) if e is not None]
+        with metrics.timer("match"):
+            matches = dict(zip(
+                encoded,
+                gallery.match(
+                    [encodings[i] for i in encoded], self.threshold
+                )
+            ))
+
+        started = time.perf_counter()
+        unknown_faces = 0
+
+        detections = []
+
+        for i, (box, track_id) in enumerate(zip(boxes, track_ids)):
+            encoding = encodings[i]
+
+            if i in matches:
+                match = matches[i]
+                name = match[0]
+            else:
+                # Tracked face: keep its identity without re-encoding
+                match = None
+                name = face_tracks.identity(track_id)
+                if name is None:
+                    # Track ended meanwhile; it will be encoded next time
+                    continue
+
+            # Handle unknown faces
+            new_unknown = False
+            if name is None:
+                unknown_faces += 1
+                unknown_id = self.tracker.identify_unknown(
+                    encoding, self.threshold
+                )
+
+                if unknown_id is None:
+                    unknown_id = f"{UNKNOWN_PREFIX}{self.unknown_counter}"
+                    self.tracker.add_unknown(encoding, unknown_id)
+                    self.unknown_counter += 1
+                    new_unknown = True
+
+                name = unknown_id
+                match = (unknown_id, None, None)
+
+            # Snapshot new unknowns; the writer may keep a better later crop.
+            # The frame is reused after this call, so the crop is copied.
+            if self.snapshots is not None and (
+                new_unknown or self.snapshots.wants(name)
+            ):
+                self.snapshots.offer(name, crop_face(frame, box), new_unknown)
+
+            # Final safety check
+            if not name or name.strip() == "":
+                name = "Unknown"
+
+            # Track entry and exit events
+            state = self.tracker.seen(name, now, camera)
+
+            if state == "ENTER":
+                self.writer.create_session(
+                    name, datetime.now().isoformat(), camera
+                )
+
+            elif isinstance(state, tuple):
+                # Re-entry opens a new session carrying the time away
+                self.writer.create_session(
+                    name, datetime.now().isoformat(), camera, state[1]
+                )
+
+            detections.append((track_id, box, match))
+
+        # Carry identities forward to the next pass and the display
+        face_tracks.update(frame, detections, now)
+
+        # Close the sessions of people unseen for too long
+        wall_now = datetime.now()
+        for pid, last_seen, exit_camera in self.tracker.expire(now):
+            left = wall_now - timedelta(seconds=now - last_seen)
+            self.writer.update_exit(
+                pid, left.isoformat(), camera=exit_camera
+            )
+
+        metrics.observe(
+            "track", track_seconds + time.perf_counter() - started
+        )
+        metrics.inc("frames_recognized", camera=camera)
+        metrics.inc("faces_recognized", len(matches) - unknown_faces,
+                    camera=camera)
+        metrics.inc("faces_unknown", unknown_faces, camera=camera)
+
+
+# ===================== RECOGNITION WORKER POOL =====================
+
+def _pool_worker(jobs, done):
+    """
+    Worker process: detect and encode faces in frames read
+    in place from the shared frame ring.
+    """
+    rings = {}
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        (seq, ring_name, shape, slots, slot, frame_seq, skip_boxes,
+         scale, regions, region_scale) = job
+        started = time.perf_counter()
+        # Seconds per stage, plus the whole frame
+        timings = {}
+        try:
+            ring = rings.get(ring_name)
+            if ring is None:
+                ring = rings[ring_name] = FrameRing.attach(
+                    ring_name, shape, slots
+                )
+
+            boxes, encodings = detect_and_encode(
+                ring.view(slot), scale=scale, skip_boxes=skip_boxes,
+                regions=regions, region_scale=region_scale, timings=timings
+            )
+
+            # The slot is pinned, but never trust a frame that changed
+            if ring.seq(slot) != frame_seq:
+                raise RuntimeError(f"frame {frame_seq} was overwritten")
+
+            timings["frame"] = time.perf_counter() - started
+            done.put((seq, boxes, encodings, timings, None))
+        except Exception as e:
+            timings["frame"] = time.perf_counter() - started
+            done.put((seq, [], [], timings, repr(e)))
+
+    for ring in rings.values():
+        ring.close()
+
+
+class FrameResult:
+    """
+    Detections for one submitted frame of a camera. `frame` is a view
+    into that camera's frame ring and is only valid until the result
+    is released. `captured` and `submitted` are time.monotonic() values.
+    """
+
+    __slots__ = (
+        "seq", "camera", "ring", "slot", "frame_seq", "frame", "boxes",
+        "encodings", "captured", "submitted"
+    )
+
+    def __init__(self, seq, camera, ring, slot, frame_seq, frame, boxes,
+                 encodings, captured, submitted):
+        self.seq = seq
+        self.camera = camera
+        self.ring = ring
+        self.slot = slot
+        self.frame_seq = frame_seq
+        self.frame = frame
+        self.boxes = boxes
+        self.encodings = encodings
+        self.captured = captured
+        self.submitted = submitted
+
+
+class RecognitionPool:
+    """
+    Process pool running face detection and encoding.
+
+    Workers read frames in place from shared FrameRings (one per
+    camera), so only a small job description crosses the process
+    boundary. A submitted slot stays pinned until its result is
+    released. When too many frames are in flight, submit() refuses
+    the frame (backpressure) and the caller simply moves on to a newer
+    one. Results are handed back in submission order to a single
+    consumer.
+
+    A frame whose result hasn't arrived within `result_timeout` is
+    skipped, and a worker that died is replaced, so one crashed worker
+    can't stall recognition.
+    """
+
+    # Longest wait for a result before checking deadlines and workers
+    POLL_SECONDS = 0.5
+
+    def __init__(self, workers=RECOGNITION_WORKERS,
+                 frames_per_worker=RECOGNITION_FRAMES_PER_WORKER,
+                 result_timeout=RECOGNITION_RESULT_TIMEOUT):
+        self.workers = workers or default_worker_count()
+        self.max_in_flight = self.workers * frames_per_worker
+        self.result_timeout = result_timeout
+
+        self._ctx = mp.get_context("spawn")
+        self.jobs = self._ctx.Queue()
+        self.done = self._ctx.Queue()
+        self._closing = False
+        self.processes = [self._start_worker() for _ in range(self.workers)]
+
+        self.lock = threading.Lock()
+        self.capacity = threading.Condition(self.lock)
+
+        self._seq = 0
+        self._next = 0
+        # seq -> (camera, ring, slot, frame_seq, captured, submitted)
+        self._in_flight = {}
+        self._finished = {}    # completed out of order, waiting for _next
+
+        # Seconds workers spent on frames, for utilization()
+        self.busy_seconds = 0.0
+        self._busy_mark = (0.0, time.monotonic())
+
+        metrics.gauge("recognition_in_flight", lambda: len(self._in_flight))
+        metrics.gauge("recognition_workers", lambda: self.workers)
+
+    def submit(self, ring, slot, skip_boxes=(), camera=None,
+               scale=FRAME_RESIZE_SCALE, regions=None, region_scale=None):
+        """
+        Queue a committed ring slot for recognition at the given scale,
+        optionally only within regions (see detect_and_encode).
+        Returns False when the pool is saturated and the frame was dropped.
+        """
+        with self.lock:
+            if len(self._in_flight) >= self.max_in_flight:
+                return False
+
+            ring.pin(slot)
+            seq = self._seq
+            self._seq += 1
+            frame_seq = ring.seq(slot)
+            self._in_flight[seq] = (
+                camera, ring, slot, frame_seq, ring.stamps[slot],
+                time.monotonic()
+            )
+
+        self.jobs.put((
+            seq, ring.name, ring.shape, ring.slots, slot, frame_seq,
+            list(skip_boxes), scale, regions, region_scale
+        ))
+        return True
+
+    def _start_worker(self):
+        process = self._ctx.Process(
+            target=_pool_worker, args=(self.jobs, self.done), daemon=True
+        )
+        process.start()
+        return process
+
+    def _replace_dead_workers(self):
+        """
+        Start a new worker for each one that exited unexpectedly; the
+        frame it was working on is skipped once its deadline passes.
+        """
+        for i, process in enumerate(self.processes):
+            if self._closing or process.is_alive():
+                continue
+            print(
+                f"[ERROR] Recognition worker exited "
+                f"(code {process.exitcode}); starting a new one"
+            )
+            metrics.inc("recognition_worker_restarts")
+            self.processes[i] = self._start_worker()
+
+    def results(self):
+        """
+        Yield a FrameResult per submitted frame, in submission order.
+        Each one must be passed to release() once processed.
+        """
+        while True:
+            try:
+                item = self.done.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                item = ()
+                self._replace_dead_workers()
+            if item is None:
+                return
+
+            if item:
+                seq, boxes, encodings, timings, error = item
+                self.busy_seconds += timings["frame"]
+                # Stage times measured in the worker process
+                for stage, seconds in timings.items():
+                    metrics.observe(stage, seconds)
+                if error:
+                    print(f"[ERROR] Recognition worker failed: {error}")
+                # A frame already given up on stays skipped
+                if seq >= self._next:
+                    self._finished[seq] = (boxes, encodings)
+
+            while True:
+                with self.lock:
+                    if self._next not in self._finished:
+                        # A result that never arrives must not stall the rest
+                        if self._overdue(self._next):
+                            self._skip_lost()
+                            continue
+                        break
+
+                    seq = self._next
+                    self._next += 1
+                    boxes, encodings = self._finished.pop(seq)
+                    camera, ring, slot, frame_seq, captured, submitted = (
+                        self._in_flight[seq]
+                    )
+
+                yield FrameResult(
+                    seq, camera, ring, slot, frame_seq, ring.view(slot),
+                    boxes, encodings, captured, submitted
+                )
+
+    def _overdue(self, seq):
+        entry = self._in_flight.get(seq)
+        return (
+            entry is not None
+            and time.monotonic() - entry[5] > self.result_timeout
+        )
+
+    def _skip_lost(self):
+        seq = self._next
+        self._next += 1
+        metrics.inc("frames_lost")
+        entry = self._in_flight.pop(seq)
+        entry[1].unpin(entry[2])
+        self.capacity.notify_all()
+
+    def release(self, result):
+        """
+        Unpin a result's ring slot so capture may reuse it.
+        """
+        result.frame = None
+        with self.lock:
+            self._in_flight.pop(result.seq, None)
+            self.capacity.notify_all()
+        result.ring.unpin(result.slot)
+
+    def utilization(self):
+        """
+        Share of total worker time spent recognizing since the last call.
+        """
+        busy, since = self._busy_mark
+        now = time.monotonic()
+        self._busy_mark = (self.busy_seconds, now)
+
+        if now <= since:
+            return 0.0
+        return (self.busy_seconds - busy) / ((now - since) * self.workers)
+
+    def wait_for_capacity(self, timeout=None):
+        """
+        Block until another frame could be submitted.
+        """
+        with self.lock:
+            if len(self._in_flight) < self.max_in_flight:
+                return True
+            return self.capacity.wait(timeout)
+
+    def close(self):
+        self._closing = True
+        for _ in self.processes:
+            self.jobs.put(None)
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+
+        # Ends any results() loop
+        self.done.put(None)
+
+
+def default_worker_count():
+    """
+    One worker per CPU core, leaving one core for capture and display.
+    """
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def ring_slots(workers=RECOGNITION_WORKERS,
+               frames_per_worker=RECOGNITION_FRAMES_PER_WORKER):
+    """
+    Ring size needed so capture always finds a free slot: every frame
+    in flight, plus the latest frame, the ones being displayed and
+    dispatched, and the one being written.
+    """
+    if FRAME_RING_SLOTS:
+        return FRAME_RING_SLOTS
+    return (workers or default_worker_count()) * frames_per_worker + 4
+
+
+# ===================== CAMERA SCHEDULING =====================
+
+class CameraSchedule:
+    """
+    Scheduling state of one camera.
+    """
+
+    __slots__ = (
+        "motion", "checked_seq", "last_seq", "last_time", "motion_until",
+        "last_sweep"
+    )
+
+    def __init__(self):
+        self.motion = MotionDetector()
+        self.checked_seq = -1
+        self.last_seq = None
+        self.last_time = float("-inf")
+        self.motion_until = float("-inf")
+        self.last_sweep = float("-inf")
+
+
+class AdaptiveScheduler:
+    """
+    Decides, per camera, whether the newest frame is worth recognizing
+    and at which scale.
+
+    A camera is active while it shows motion (plus motion_hold seconds)
+    or has tracked faces. Active cameras are recognized every `skip`
+    frames at active_scale; idle ones only every idle_seconds at
+    base_scale.
+
+    Once a second the workers' busy share is compared with cpu_budget.
+    Over budget, the scheduler steps down a level: first back to
+    base_scale, then one more skipped frame per level. Well under
+    budget it steps back up.
+
+    With use_regions, active cameras are searched only around motion
+    and tracked faces, at roi_scale (see regions()); the whole frame
+    is still swept every full_sweep seconds.
+    """
+
+    # Never skip more than this many frames while active
+    MAX_SKIP = 30
+
+    # Step back up only below this share of the budget
+    RELAX_BELOW = 0.7
+
+    def __init__(self, pool, pipeline, frame_skip=FRAME_SKIP,
+                 base_scale=FRAME_RESIZE_SCALE,
+                 active_scale=ACTIVE_RESIZE_SCALE,
+                 idle_seconds=IDLE_RECOGNITION_SECONDS,
+                 motion_hold=MOTION_HOLD_SECONDS,
+                 cpu_budget=RECOGNITION_CPU_BUDGET,
+                 use_regions=ROI_DETECTION, roi_scale=ROI_RESIZE_SCALE,
+                 full_sweep=ROI_FULL_SWEEP_SECONDS,
+                 track_padding=ROI_TRACK_PADDING,
+                 motion_padding=ROI_MOTION_PADDING,
+                 min_region=ROI_MIN_SIZE):
+        self.pool = pool
+        self.pipeline = pipeline
+        self.frame_skip = max(1, frame_skip)
+        self.base_scale = base_scale
+        self.active_scale = max(active_scale, base_scale)
+        self.idle_seconds = idle_seconds
+        self.motion_hold = motion_hold
+        self.cpu_budget = cpu_budget
+        self.use_regions = use_regions
+        self.roi_scale = roi_scale
+        self.full_sweep = full_sweep
+        self.track_padding = track_padding
+        self.motion_padding = motion_padding
+        self.min_region = min_region
+
+        # 0 = full rate at active_scale; higher levels trade quality
+        # and then frame rate for CPU
+        self.level = 0
+        self.max_level = self.MAX_SKIP - self.frame_skip + 1
+        self._checked = time.monotonic()
+
+        self.cameras = {}
+
+    @property
+    def skip(self):
+        return self.frame_skip + max(0, self.level - 1)
+
+    @property
+    def scale(self):
+        return self.active_scale if self.level == 0 else self.base_scale
+
+    def decide(self, camera, frame, seq, now=None):
+        """
+        Scale to recognize this frame at, or None to skip it.
+        """
+        now = time.monotonic() if now is None else now
+        state = self.cameras.get(camera)
+        if state is None:
+            state = self.cameras[camera] = CameraSchedule()
+
+        # Each frame is checked for motion once, even if not recognized
+        if seq != state.checked_seq:
+            state.checked_seq = seq
+            if state.motion.update(frame):
+                state.motion_until = now + self.motion_hold
+
+        self._control(now)
+
+        if seq == state.last_seq:
+            return None
+
+        active = (
+            now < state.motion_until
+            or len(self.pipeline.tracks_for(camera)) > 0
+        )
+
+        if active:
+            if (state.last_seq is not None
+                    and seq - state.last_seq < self.skip):
+                return None
+            return self.scale
+
+        if now - state.last_time < self.idle_seconds:
+            return None
+        return self.base_scale
+
+    def regions(self, camera, shape, scale, now=None):
+        """
+        Where to look for faces in the camera's frame that decide() just
+        accepted. Returns (regions, region_scale), or (None, scale) for
+        a full-frame pass.
+
+        Regions are the motion areas and the tracked face boxes, padded
+        and merged. They are searched at roi_scale, lowered if needed so
+        that they never cost more pixels than a full frame at `scale`;
+        if even that isn't possible, the full frame is searched.
+        """
+        now = time.monotonic() if now is None else now
+        state = self.cameras[camera]
+
+        if not self.use_regions or now - state.last_sweep >= self.full_sweep:
+            return None, scale
+
+        boxes = [
+            expand_box(box, self.motion_padding, shape, self.min_region)
+            for box in state.motion.regions(shape)
+        ]
+        boxes += [
+            expand_box(box, self.track_padding, shape, self.min_region)
+            for box in self.pipeline.tracks_for(camera).boxes(now)
+        ]
+        boxes = [b for b in merge_boxes(boxes) if b[0] < b[2] and b[3] < b[1]]
+        if not boxes:
+            return None, scale
+
+        # Detection cost grows with the number of pixels searched
+        area = sum((b[2] - b[0]) * (b[1] - b[3]) for b in boxes)
+        full_cost = shape[0] * shape[1] * scale ** 2
+        region_scale = min(self.roi_scale, (full_cost / area) ** 0.5)
+
+        if region_scale <= scale:
+            return None, scale
+        return boxes, region_scale
+
+    def submitted(self, camera, seq, full_frame=True, now=None):
+        state = self.cameras[camera]
+        state.last_seq = seq
+        state.last_time = time.monotonic() if now is None else now
+        if full_frame:
+            state.last_sweep = state.last_time
+
+    def _control(self, now):
+        if now - self._checked < 1.0:
+            return
+        self._checked = now
+
+        load = self.pool.utilization() / self.cpu_budget
+        if load > 1 and self.level < self.max_level:
+            self.level += 1
+        elif load < self.RELAX_BELOW and self.level > 0:
+            self.level -= 1
+
+
+class FrameDispatcher:
+    """
+    Feeds the newest frame of every camera to the recognition pool.
+
+    Cameras take turns: when the pool is full, the camera that was
+    refused goes first once capacity frees up, so a busy or fast
+    stream can't starve the others. The AdaptiveScheduler decides
+    which frames are offered at all, and at what scale. Frames older
+    than `max_age` (e.g. the last one of a stalled stream) are never
+    offered, so results always describe the recent past.
+    """
+
+    def __init__(self, cameras, pool, pipeline, notify, scheduler=None,
+                 max_age=MAX_FRAME_AGE):
+        self.cameras = cameras
+        self.pool = pool
+        self.pipeline = pipeline
+        self.notify = notify
+        self.scheduler = scheduler or AdaptiveScheduler(pool, pipeline)
+        self.max_age = max_age
+
+        # Last stale frame seen per camera, so each is counted once
+        self._stale = {}
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.notify.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        turn = 0
+
+        while not self._stop.is_set():
+            # Woken by any camera committing a frame
+            self.notify.wait(timeout=0.1)
+            self.notify.clear()
+
+            blocked = False
+            for step in range(len(self.cameras)):
+                index = (turn + step) % len(self.cameras)
+                camera = self.cameras[index]
+                if camera.ring is None:
+                    continue
+
+                seq, slot = camera.ring.latest()
+                if slot is None:
+                    continue
+
+                try:
+                    if camera.ring.age(slot) > self.max_age:
+                        if self._stale.get(camera.name) != seq:
+                            self._stale[camera.name] = seq
+                            metrics.inc(
+                                "frames_dropped", camera=camera.name,
+                                reason="stale"
+                            )
+                        continue
+
+                    frame = camera.ring.view(slot)
+                    scale = self.scheduler.decide(camera.name, frame, seq)
+                    if scale is None:
+                        continue
+
+                    regions, region_scale = self.scheduler.regions(
+                        camera.name, frame.shape, scale
+                    )
+
+                    if not self.pool.submit(
+                        camera.ring, slot,
+                        self.pipeline.skip_boxes(camera.name), camera.name,
+                        scale, regions, region_scale
+                    ):
+                        # This camera goes first once a worker frees up
+                        metrics.inc(
+                            "frames_dropped", camera=camera.name,
+                            reason="busy"
+                        )
+                        turn = index
+                        blocked = True
+                        break
+
+                    self.scheduler.submitted(
+                        camera.name, seq, regions is None
+                    )
+                    turn = (index + 1) % len(self.cameras)
+                finally:
+                    camera.ring.unpin(slot)
+
+            if blocked:
+                self.pool.wait_for_capacity(timeout=0.1)
+                self.notify.set()
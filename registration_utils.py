@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from face_utils import EncodingCache
+from snapshot_utils import crop_face, crop_sharpness
+from config import (
+    KNOWN_FACES_DIR,
+    ENCODING_CACHE_DIR,
+    ENROLL_MIN_FACE_SIZE,
+    ENROLL_MIN_SHARPNESS,
+    REGISTER_SAMPLES,
+    REGISTER_MIN_SAMPLES,
+    REGISTER_TIMEOUT_SECONDS,
+    REGISTER_SAMPLE_INTERVAL,
+    REGISTER_MIN_SAMPLE_DISTANCE
+)
+
+
+# One registration saves its files at a time (they share the cache)
+_save_lock = threading.Lock()
+
+
+# ===================== LIVE REGISTRATION =====================
+
+def valid_person_name(name):
+    """
+    Whether a name can be a person's folder in the known faces folder:
+    one path component with at least one letter or digit (so never
+    "." or "..").
+    """
+    return (
+        name == name.strip()
+        and name not in ("", ".", "..")
+        and os.path.basename(name) == name
+        and "/" not in name and "\\" not in name
+        and any(char.isalnum() for char in name)
+    )
+
+
+class RegistrationJob:
+    """
+    Registers one person from the frames recognition already processes.
+
+    The recognizer hands every pass of the job's camera to offer().
+    A frame counts when it shows exactly one face that is big and
+    sharp enough, comes at least `interval` seconds after the last
+    sample and differs from every kept sample by `min_distance`, so
+    the samples cover several poses. Its encoding is kept straight
+    away; nothing is re-encoded when the job completes.
+    """
+
+    def __init__(self, name, camera, samples=REGISTER_SAMPLES,
+                 min_samples=REGISTER_MIN_SAMPLES,
+                 timeout=REGISTER_TIMEOUT_SECONDS,
+                 interval=REGISTER_SAMPLE_INTERVAL,
+                 min_distance=REGISTER_MIN_SAMPLE_DISTANCE,
+                 min_face_size=ENROLL_MIN_FACE_SIZE,
+                 min_sharpness=ENROLL_MIN_SHARPNESS, now=None):
+        if not valid_person_name(name):
+            raise ValueError(f"Invalid person name {name!r}")
+        self.name = name
+        self.camera = camera
+        self.samples = samples
+        self.min_samples = min(min_samples, samples)
+        self.interval = interval
+        self.min_distance = min_distance
+        self.min_face_size = min_face_size
+        self.min_sharpness = min_sharpness
+
+        now = time.monotonic() if now is None else now
+        self.deadline = now + timeout
+        self.last_sample = -np.inf
+
+        self.encodings = []
+        self.crops = []
+
+        # "collecting", then "done" or "failed" (at time `ended`)
+        self.state = "collecting"
+        self.ended = None
+        self.hint = "Look at the camera"
+
+    @property
+    def finished(self):
+        return self.state != "collecting"
+
+    def status(self):
+        """
+        One line for the display overlay.
+        """
+        if self.state == "done":
+            return f"Registered {self.name} ({len(self.encodings)} samples)"
+        if self.state == "failed":
+            return f"Registration of {self.name} failed: {self.hint}"
+        return (
+            f"Registering {self.name}: {len(self.encodings)}/{self.samples}"
+            f" | {self.hint}"
+        )
+
+    def cancel(self, now=None):
+        if not self.finished:
+            self.state = "failed"
+            self.hint = "cancelled"
+            self.ended = time.monotonic() if now is None else now
+
+    def offer(self, frame, boxes, encodings, now=None):
+        """
+        Consider one processed frame; returns True if a sample was kept.
+        """
+        if self.finished:
+            return False
+
+        now = time.monotonic() if now is None else now
+        kept = self._consider(frame, boxes, encodings, now)
+
+        if len(self.encodings) >= self.samples:
+            self.state = "done"
+        elif now >= self.deadline:
+            if len(self.encodings) >= self.min_samples:
+                self.state = "done"
+            else:
+                self.state = "failed"
+                self.hint = "not enough clear samples"
+
+        if self.finished:
+            self.ended = now
+        return kept
+
+    def _consider(self, frame, boxes, encodings, now):
+        if len(boxes) != 1:
+            self.hint = (
+                "Only one face should be visible" if boxes
+                else "Look at the camera"
+            )
+            return False
+
+        encoding = encodings[0]
+        if encoding is None or now - self.last_sample < self.interval:
+            return False
+
+        top, right, bottom, left = boxes[0]
+        if min(bottom - top, right - left) < self.min_face_size:
+            self.hint = "Come closer"
+            return False
+
+        crop = crop_face(frame, boxes[0])
+        if crop is None:
+            return False
+        if crop_sharpness(crop) < self.min_sharpness:
+            self.hint = "Hold still"
+            return False
+
+        encoding = np.asarray(encoding, dtype=np.float32)
+        if self.encodings and np.min(np.linalg.norm(
+            np.asarray(self.encodings) - encoding, axis=1
+        )) < self.min_distance:
+            self.hint = "Turn your head slowly"
+            return False
+
+        self.encodings.append(encoding)
+        self.crops.append(crop)
+        self.last_sample = now
+        self.hint = "Turn your head slowly"
+        return True
+
+    def save(self, known_dir=KNOWN_FACES_DIR, cache_dir=ENCODING_CACHE_DIR):
+        """
+        Write the sample crops to known_dir/<name>/ and their encodings
+        to the encoding cache, on a background thread (the next start
+        then needs no encoding). Returns the thread.
+        """
+        thread = threading.Thread(
+            target=self._save, args=(known_dir, cache_dir)
+        )
+        thread.start()
+        return thread
+
+    def _save(self, known_dir, cache_dir):
+        person_dir = os.path.join(known_dir, self.name)
+        os.makedirs(person_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        records = []
+        for i, (crop, encoding) in enumerate(zip(self.crops, self.encodings)):
+            path = os.path.join(person_dir, f"{stamp}_{i}.jpg")
+            if not cv2.imwrite(path, crop):
+                print(f"[ERROR] Could not write registration sample {path}")
+                continue
+            records.append((self.name, path, os.stat(path), encoding))
+
+        with _save_lock:
+            if cache_dir and records:
+                EncodingCache(cache_dir).add(records)
+
+        # The crops are on disk now
+        self.crops = []
+        print(
+            f"[SUCCESS] Registration completed for {self.name} "
+            f"({len(records)} samples saved)"
+        )
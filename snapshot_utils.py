@@ -0,0 +1,263 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+from metrics_utils import metrics
+from config import (
+    INTRUDER_SNAPSHOTS_DIR,
+    SNAPSHOT_FORMAT,
+    SNAPSHOT_QUALITY,
+    SNAPSHOT_QUEUE_SIZE,
+    SNAPSHOT_DROP_POLICY,
+    SNAPSHOT_SELECT,
+    SNAPSHOT_SELECT_WINDOW
+)
+
+
+# ===================== CROP QUALITY =====================
+
+def crop_sharpness(image):
+    """
+    Variance of the Laplacian: higher for crisp, well-focused faces.
+    """
+    grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(grey, cv2.CV_64F).var())
+
+
+def crop_area(image):
+    return image.shape[0] * image.shape[1]
+
+
+SELECT_SCORES = {
+    "sharpest": crop_sharpness,
+    "largest": crop_area,
+}
+
+
+def crop_face(frame, face_location):
+    """
+    Copy a face out of a frame, or None if the box is invalid.
+    The copy stays valid after the frame buffer is reused.
+    """
+    top, right, bottom, left = face_location
+    h, w = frame.shape[:2]
+
+    if not (0 <= top < bottom <= h and 0 <= left < right <= w):
+        return None
+    return frame[top:bottom, left:right].copy()
+
+
+# ===================== SNAPSHOT WRITER =====================
+
+class SnapshotWriter:
+    """
+    Saves face crops on a background thread, so image encoding and
+    disk writes never hold up recognition.
+
+    The queue is bounded. When it is full, `drop_policy` decides what
+    to lose: "newest" drops the incoming crop, "oldest" drops the
+    longest-waiting one.
+
+    With select="sharpest" or "largest", crops offered for one unknown
+    ID during `select_window` seconds after its first sighting are
+    compared and only the best one is written; select="first" writes
+    the first crop straight away.
+    """
+
+    _STOP = object()
+
+    def __init__(self, directory=INTRUDER_SNAPSHOTS_DIR,
+                 image_format=SNAPSHOT_FORMAT, quality=SNAPSHOT_QUALITY,
+                 queue_size=SNAPSHOT_QUEUE_SIZE,
+                 drop_policy=SNAPSHOT_DROP_POLICY, select=SNAPSHOT_SELECT,
+                 select_window=SNAPSHOT_SELECT_WINDOW):
+        if select != "first" and select not in SELECT_SCORES:
+            raise ValueError(f"Unknown snapshot selection '{select}'")
+        if drop_policy not in ("newest", "oldest"):
+            raise ValueError(f"Unknown snapshot drop policy '{drop_policy}'")
+
+        self.directory = directory
+        self.extension = image_format.lower().lstrip(".")
+        self.params = _encode_params(self.extension, quality)
+        self.drop_policy = drop_policy
+        self.select = select
+        self.select_window = select_window if select != "first" else 0
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+        # Unknown IDs whose selection window is still open -> deadline;
+        # read by the recognizer, so guarded by a lock
+        self._open = {}
+        self._lock = threading.Lock()
+
+        metrics.gauge("snapshot_queue_depth", self.queue.qsize)
+
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def wants(self, unknown_id, now=None):
+        """
+        True while later crops of this unknown could still be picked,
+        so the caller can skip copying faces that would be thrown away.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            deadline = self._open.get(unknown_id)
+            return deadline is not None and now < deadline
+
+    def offer(self, unknown_id, crop, new=False, now=None):
+        """
+        Queue a crop (already copied out of the frame) for an unknown ID.
+        new=True marks the first sighting and opens the selection
+        window. Returns False if the crop was not queued.
+        """
+        if crop is None:
+            return False
+
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if new:
+                self._open[unknown_id] = now + self.select_window
+            elif now >= self._open.get(unknown_id, now):
+                return False
+            deadline = self._open[unknown_id]
+
+        return self._put((unknown_id, crop, datetime.now(), deadline))
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.drop_policy == "oldest":
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(item)
+                self._count_drop()
+                return True
+            except queue.Full:
+                pass
+
+        self._count_drop()
+        return False
+
+    def _count_drop(self):
+        metrics.inc("snapshots_dropped")
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            print(
+                f"[INFO] Snapshot writer is behind; "
+                f"{self.dropped} snapshots dropped so far"
+            )
+
+    def close(self, timeout=10):
+        """
+        Write everything still queued or being selected, then stop.
+        """
+        self.queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        # unknown_id -> (score, crop, first seen timestamp, deadline)
+        best = {}
+
+        while True:
+            # Wake up in time to write the next finished selection
+            timeout = None
+            if best:
+                timeout = max(
+                    0, min(b[3] for b in best.values()) - time.monotonic()
+                )
+
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                break
+
+            if item is not None:
+                self._select(best, *item)
+
+            now = time.monotonic()
+            for unknown_id in [
+                k for k, b in best.items() if b[3] <= now
+            ]:
+                self._finish(unknown_id, best.pop(unknown_id))
+            self._close_stale(best, now)
+
+        for unknown_id, entry in best.items():
+            self._finish(unknown_id, entry)
+
+    def _close_stale(self, best, now):
+        """
+        Forget expired windows that have no crop waiting, e.g. because
+        the queue dropped it or it arrived too late; nothing else
+        would remove them.
+        """
+        with self._lock:
+            for unknown_id in [
+                k for k, deadline in self._open.items()
+                if deadline <= now and k not in best
+            ]:
+                del self._open[unknown_id]
+
+    def _select(self, best, unknown_id, crop, timestamp, deadline):
+        if self.select == "first":
+            self._finish(unknown_id, (0, crop, timestamp, deadline))
+            return
+
+        entry = best.get(unknown_id)
+        if entry is None and deadline <= time.monotonic():
+            # Arrived after this unknown's snapshot was written
+            return
+
+        score = SELECT_SCORES[self.select](crop)
+        if entry is None:
+            best[unknown_id] = (score, crop, timestamp, deadline)
+        elif score > entry[0]:
+            best[unknown_id] = (score, crop, entry[2], entry[3])
+
+    def _finish(self, unknown_id, entry):
+        _, crop, timestamp, _ = entry
+        with self._lock:
+            self._open.pop(unknown_id, None)
+
+        path = os.path.join(
+            self.directory,
+            f"{unknown_id}_{timestamp.strftime('%Y%m%d_%H%M%S')}"
+            f".{self.extension}"
+        )
+        self._write(path, crop)
+
+    def _write(self, path, image):
+        try:
+            with metrics.timer("snapshot_save"):
+                ok = cv2.imwrite(path, image, self.params)
+            if not ok:
+                print(f"[ERROR] Could not write snapshot {path}")
+        except cv2.error as e:
+            print(f"[ERROR] Could not write snapshot {path}: {e}")
+
+
+def _encode_params(extension, quality):
+    if extension in ("jpg", "jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if extension == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if extension == "png":
+        # Lossless; quality does not apply
+        return [cv2.IMWRITE_PNG_COMPRESSION, 3]
+    raise ValueError(f"Unsupported snapshot format '{extension}'")
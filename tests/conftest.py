@@ -0,0 +1,60 @@
+import importlib.util
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Without dlib, a small fake encoder stands in for face_recognition
+if importlib.util.find_spec("face_recognition") is None:
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "fakes"))
+
+import face_utils
+
+
+def fake_encoding(path):
+    """
+    A distinct, repeatable vector per image file content.
+    """
+    with open(path, "rb") as f:
+        seed = sum(f.read())
+    return np.random.RandomState(seed).rand(128).astype(np.float32)
+
+
+@pytest.fixture
+def gallery_dirs(tmp_path):
+    """
+    (known faces folder, encoding cache folder) of an empty gallery.
+    """
+    return str(tmp_path / "known"), str(tmp_path / "cache")
+
+
+@pytest.fixture
+def write_image():
+    def write(known_dir, person, name, content):
+        person_dir = os.path.join(known_dir, person)
+        os.makedirs(person_dir, exist_ok=True)
+        path = os.path.join(person_dir, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    return write
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    """
+    Encode image files with fake_encoding; returns the paths encoded.
+    """
+    paths = []
+
+    def encode(path, *args):
+        paths.append(path)
+        return fake_encoding(path)
+
+    monkeypatch.setattr(face_utils, "_encode_image", encode)
+    return paths
@@ -0,0 +1,51 @@
+"""
+Stand-in for the face_recognition package when dlib isn't installed.
+
+Every image holds one face in its middle half; its encoding is derived
+from the image's pixels, so equal images encode equally. Worker
+processes import it too, since the test session's sys.path is passed
+on to them.
+
+FAKE_FACE_DELAY (seconds) slows detection down, and FAKE_FACE_STARTED
+names a file created when a detection starts.
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+def load_image_file(path):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"cannot read {path}")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def face_locations(image, number_of_times_to_upsample=1, model="hog"):
+    started = os.environ.get("FAKE_FACE_STARTED")
+    if started:
+        open(started, "w").close()
+    time.sleep(float(os.environ.get("FAKE_FACE_DELAY", 0)))
+
+    h, w = image.shape[:2]
+    return [(h // 4, 3 * w // 4, 3 * h // 4, w // 4)]
+
+
+def face_encodings(image, known_face_locations=None, num_jitters=1,
+                   model="small"):
+    if known_face_locations is None:
+        known_face_locations = face_locations(image)
+
+    encodings = []
+    for top, right, bottom, left in known_face_locations:
+        seed = int(image[top:bottom, left:right].sum()) % (2 ** 32)
+        encodings.append(np.random.RandomState(seed).rand(128))
+    return encodings
+
+
+def face_distance(face_encodings, face_to_compare):
+    if len(face_encodings) == 0:
+        return np.empty(0)
+    return np.linalg.norm(np.asarray(face_encodings) - face_to_compare, axis=1)
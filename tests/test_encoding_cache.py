@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+
+from conftest import fake_encoding
+from face_utils import EncodingCache, load_known_faces
+
+
+def test_added_records_keep_their_names_after_reload(
+    gallery_dirs, write_image, encoded
+):
+    known_dir, cache_dir = gallery_dirs
+
+    alice = write_image(known_dir, "alice", "a.jpg", b"alice")
+    carol = write_image(known_dir, "carol", "c.jpg", b"carol")
+    load_known_faces(known_dir, cache_dir)
+
+    # Enrolled elsewhere: appended after carol's row in the cache
+    bob = write_image(known_dir, "bob", "b.jpg", b"bob")
+    EncodingCache(cache_dir).add(
+        [("bob", bob, os.stat(bob), fake_encoding(bob))]
+    )
+
+    encoded.clear()
+    for _ in range(2):
+        matrix, names = load_known_faces(known_dir, cache_dir)
+
+        assert encoded == []
+        assert names == ["alice", "bob", "carol"]
+        for row, path in zip(matrix, [alice, bob, carol]):
+            np.testing.assert_array_equal(row, fake_encoding(path))
+
+
+def test_cache_is_shared_by_relative_and_absolute_paths(
+    tmp_path, monkeypatch, write_image, encoded
+):
+    monkeypatch.chdir(tmp_path)
+    write_image("known", "alice", "a.jpg", b"alice")
+    write_image("known", "bob", "b.jpg", b"bob")
+    load_known_faces("known", "cache")
+    fingerprint = EncodingCache("cache").fingerprint()
+
+    encoded.clear()
+    _, names = load_known_faces(str(tmp_path / "known"), "cache")
+
+    assert encoded == []
+    assert names == ["alice", "bob"]
+    assert EncodingCache("cache").fingerprint() == fingerprint
+    assert EncodingCache("cache").pending(
+        [("bob", str(tmp_path / "known" / "bob" / "b.jpg"),
+          os.stat("known/bob/b.jpg"))]
+    ) == []
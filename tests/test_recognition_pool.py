@@ -0,0 +1,77 @@
+import threading
+import time
+
+import numpy as np
+
+from frame_utils import FrameRing
+from metrics_utils import metrics
+from pipeline_utils import RecognitionPool
+
+
+def _next_result(results, timeout=30):
+    """
+    Next item of a results() generator, or None if none comes in time.
+    """
+    got = []
+    thread = threading.Thread(target=lambda: got.append(next(results)))
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    return got[0] if got else None
+
+
+def _commit_frame(ring, value):
+    slot = ring.acquire()
+    ring.view(slot)[:] = value
+    ring.commit(slot)
+    return slot
+
+
+def _frames_lost():
+    with metrics.lock:
+        return sum(
+            v for (name, _), v in metrics.counters.items()
+            if name == "frames_lost"
+        )
+
+
+def test_killed_worker_does_not_stall_recognition(tmp_path, monkeypatch):
+    started = tmp_path / "started"
+    monkeypatch.setenv("FAKE_FACE_DELAY", "60")
+    monkeypatch.setenv("FAKE_FACE_STARTED", str(started))
+
+    ring = FrameRing((64, 64, 3), 4)
+    pool = RecognitionPool(workers=1, frames_per_worker=2, result_timeout=1)
+    lost_before = _frames_lost()
+    try:
+        first = _commit_frame(ring, 10)
+        assert pool.submit(ring, first, camera="cam")
+
+        # Kill the worker while it is detecting faces in that frame
+        deadline = time.monotonic() + 30
+        while not started.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert started.exists()
+        pool.processes[0].kill()
+        pool.processes[0].join()
+
+        # The replacement worker is quick
+        monkeypatch.setenv("FAKE_FACE_DELAY", "0")
+        second = _commit_frame(ring, 20)
+        assert pool.submit(ring, second, camera="cam")
+
+        results = pool.results()
+        result = _next_result(results)
+
+        assert result is not None
+        assert result.seq == 1
+        assert len(result.boxes) == 1
+        assert _frames_lost() == lost_before + 1
+        assert ring.pins[first] == 0
+        pool.release(result)
+
+        assert pool.processes[0].is_alive()
+        assert pool.wait_for_capacity(timeout=0)
+    finally:
+        pool.close()
+        ring.close()
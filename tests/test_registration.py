@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from conftest import fake_encoding
+from face_utils import load_known_faces
+from registration_utils import RegistrationJob, valid_person_name
+
+
+def test_registered_person_keeps_their_encodings_after_restart(
+    gallery_dirs, write_image, encoded
+):
+    known_dir, cache_dir = gallery_dirs
+    alice = write_image(known_dir, "alice", "0.jpg", b"alice")
+    carol = write_image(known_dir, "carol", "0.jpg", b"carol")
+    load_known_faces(known_dir, cache_dir)
+
+    # Sorts between the people already in the cache
+    job = RegistrationJob(
+        "bob", "cam", samples=3, min_samples=3, interval=0,
+        min_distance=0, min_face_size=0, min_sharpness=0, now=0
+    )
+    rng = np.random.RandomState(0)
+    frame = rng.randint(0, 255, (100, 100, 3)).astype(np.uint8)
+    bob = [rng.rand(128).astype(np.float32) for _ in range(3)]
+    for i, encoding in enumerate(bob):
+        job.offer(frame, [(10, 90, 90, 10)], [encoding], now=i)
+    assert job.state == "done"
+    job.save(known_dir, cache_dir).join()
+
+    matrix, names = load_known_faces(known_dir, cache_dir)
+
+    assert names == ["alice", "bob", "bob", "bob", "carol"]
+    expected = [fake_encoding(alice), *bob, fake_encoding(carol)]
+    for row, encoding in zip(matrix, expected):
+        np.testing.assert_array_equal(row, encoding)
+
+
+@pytest.mark.parametrize("name", [".", "..", "-_", " ", "a/b", "../alice"])
+def test_names_outside_one_folder_are_refused(name):
+    assert not valid_person_name(name)
+    with pytest.raises(ValueError):
+        RegistrationJob(name, "cam")
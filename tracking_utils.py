@@ -1,87 +1,551 @@
-from datetime import datetime
+import heapq
+import threading
+import time
+import cv2
 import numpy as np
 
+from config import (
+    EXIT_TIMEOUT_SECONDS,
+    UNKNOWN_CAPACITY,
+    UNKNOWN_TTL_SECONDS,
+    UNKNOWN_MERGE_DISTANCE,
+    TRACK_IOU_THRESHOLD,
+    TRACK_MAX_MISSES,
+    TRACK_REENCODE_SECONDS,
+    TRACK_MIN_MARGIN,
+    TRACK_USE_OPENCV
+)
+
+
+# Names given to faces that match no known person
+UNKNOWN_PREFIX = "UNKNOWN_"
+
+
+class UnknownStore:
+    """
+    Bounded store of unknown face encodings.
+
+    Encodings live in a preallocated float32 buffer that doubles in
+    size up to `capacity`. Entries not seen for `ttl` seconds expire,
+    and when the buffer is full the least recently seen entry is
+    overwritten, so memory stays constant for the life of the process.
+    """
+
+    def __init__(self, capacity=UNKNOWN_CAPACITY, ttl=UNKNOWN_TTL_SECONDS,
+                 merge_distance=UNKNOWN_MERGE_DISTANCE, initial_size=64):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.merge_distance = merge_distance
+
+        self._allocate(min(initial_size, capacity))
+        self.size = 0   # slots in use so far (active or expired)
+
+    def _allocate(self, slots):
+        vectors = np.zeros((slots, 128), dtype=np.float32)
+        sq_norms = np.zeros(slots, dtype=np.float32)
+        last_seen = np.full(slots, -np.inf)
+        active = np.zeros(slots, dtype=bool)
+        ids = [None] * slots
+
+        if hasattr(self, "vectors"):
+            n = len(self.vectors)
+            vectors[:n] = self.vectors
+            sq_norms[:n] = self.sq_norms
+            last_seen[:n] = self.last_seen
+            active[:n] = self.active
+            ids[:n] = self.ids
+
+        self.vectors = vectors
+        self.sq_norms = sq_norms
+        self.last_seen = last_seen
+        self.active = active
+        self.ids = ids
+
+    def __len__(self):
+        return int(self._live(time.monotonic()).sum())
+
+    def _live(self, now):
+        """
+        Mask of slots holding an unexpired entry.
+        """
+        live = self.active[:self.size]
+        if self.ttl:
+            live = live & (now - self.last_seen[:self.size] <= self.ttl)
+        return live
+
+    def match(self, face_encoding, threshold):
+        """
+        Return the ID of the closest live unknown within threshold, or None.
+        """
+        if self.size == 0:
+            return None
+
+        now = time.monotonic()
+        face = np.asarray(face_encoding, dtype=np.float32)
+
+        # Distances against the buffer in place, without copying it
+        sq = (
+            self.sq_norms[:self.size]
+            - 2.0 * (self.vectors[:self.size] @ face)
+            + float(face @ face)
+        )
+        sq[~self._live(now)] = np.inf
+
+        best = int(sq.argmin())
+        if not sq[best] < threshold * threshold:
+            return None
+
+        if self.merge_distance:
+            self._merge_into(best, np.nonzero(sq < threshold * threshold)[0])
+
+        self.last_seen[best] = now
+        return self.ids[best]
+
+    def _merge_into(self, keep, candidates):
+        """
+        Drop other entries that are near-duplicates of slot `keep`.
+        """
+        others = candidates[candidates != keep]
+        if len(others) == 0:
+            return
+
+        gaps = np.linalg.norm(self.vectors[others] - self.vectors[keep], axis=1)
+        for slot in others[gaps < self.merge_distance]:
+            self.active[slot] = False
+            self.ids[slot] = None
+
+    def add(self, face_encoding, unknown_id):
+        """
+        Store a new unknown, reusing an expired or least recently seen slot
+        once the buffer has reached capacity.
+        """
+        now = time.monotonic()
+        free = np.nonzero(~self._live(now))[0]
+
+        if len(free):
+            slot = int(free[0])
+        elif self.size < len(self.vectors):
+            slot = self.size
+            self.size += 1
+        elif len(self.vectors) < self.capacity:
+            self._allocate(min(len(self.vectors) * 2, self.capacity))
+            slot = self.size
+            self.size += 1
+        else:
+            slot = int(self.last_seen[:self.size].argmin())
+
+        face = np.asarray(face_encoding, dtype=np.float32)
+        self.vectors[slot] = face
+        self.sq_norms[slot] = face @ face
+        self.last_seen[slot] = now
+        self.active[slot] = True
+        self.ids[slot] = unknown_id
+
+
+class PersonState:
+    """
+    Presence of one person; times are time.monotonic() values.
+    """
+
+    __slots__ = ("inside", "last_seen", "last_exit", "camera")
+
+    def __init__(self, now, camera):
+        self.inside = True
+        self.last_seen = now
+        self.last_exit = None
+        self.camera = camera
+
 
 class PersonTracker:
-    def __init__(self):
-        # Tracks current state for each person
+    """
+    Turns sightings into ENTER / REENTER / EXIT events.
+
+    Everyone inside has one pending exit deadline in a min-heap, so
+    expire() only looks at people whose deadline has come, not at
+    everyone ever seen. Sightings don't touch the heap: a popped
+    deadline that a later sighting pushed back is simply re-queued.
+    """
+
+    def __init__(self, timeout=EXIT_TIMEOUT_SECONDS):
+        self.timeout = timeout
+
+        # person_id -> PersonState
         self.state = {}
 
-        # Storage for unknown face encodings
-        self.unknown_encodings = []
-        self.unknown_ids = []
+        # (deadline, person_id) of everyone inside
+        self._deadlines = []
+
+        # Bounded storage for unknown face encodings
+        self.unknowns = UnknownStore()
 
-    def seen(self, person_id):
+    def seen(self, person_id, now=None, camera=None):
         """
         Update tracking state when a person is detected in the frame.
+        Returns "ENTER", ("REENTER", seconds outside) or "INSIDE".
         """
-        now = datetime.now()
+        now = time.monotonic() if now is None else now
+        person = self.state.get(person_id)
 
-        if person_id not in self.state:
-            self.state[person_id] = {
-                "inside": True,
-                "last_seen": now,
-                "last_exit": None
-            }
+        if person is None:
+            self.state[person_id] = PersonState(now, camera)
+            heapq.heappush(self._deadlines, (now + self.timeout, person_id))
             return "ENTER"
 
-        person = self.state[person_id]
+        person.last_seen = now
+        person.camera = camera
 
-        if not person["inside"]:
-            outside_time = (
-                now - person["last_exit"]
-            ).total_seconds()
+        if not person.inside:
+            person.inside = True
+            heapq.heappush(self._deadlines, (now + self.timeout, person_id))
+            return "REENTER", now - person.last_exit
 
-            person["inside"] = True
-            person["last_seen"] = now
-            return "REENTER", outside_time
-
-        person["last_seen"] = now
         return "INSIDE"
 
-    def check_exit(self, person_id, timeout):
+    def expire(self, now=None):
         """
-        Mark a person as exited if they haven't been seen
-        for longer than the given timeout.
+        Mark everyone unseen for longer than the timeout as exited.
+        Returns (person_id, time last seen, camera) per exit; the last
+        sighting is taken as the moment they left.
         """
-        now = datetime.now()
-        person = self.state.get(person_id)
+        now = time.monotonic() if now is None else now
+        exits = []
+
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, person_id = heapq.heappop(self._deadlines)
+            person = self.state[person_id]
+
+            deadline = person.last_seen + self.timeout
+            if deadline > now:
+                # Seen again since this deadline was set
+                heapq.heappush(self._deadlines, (deadline, person_id))
+                continue
 
-        if person and person["inside"]:
-            diff = (
-                now - person["last_seen"]
-            ).total_seconds()
+            exits.append((person_id, person.last_seen, person.camera))
+            if person_id.startswith(UNKNOWN_PREFIX):
+                # Unknown IDs come and go with the unknown store; one
+                # seen again simply enters anew
+                del self.state[person_id]
+                continue
 
-            if diff > timeout:
-                person["inside"] = False
-                person["last_exit"] = now
-                return now
+            person.inside = False
+            person.last_exit = person.last_seen
 
-        return None
+        return exits
 
     def identify_unknown(self, face_encoding, threshold=0.45):
         """
         Try to match an unknown face against previously
         seen unknown encodings.
         """
-        if not self.unknown_encodings:
-            return None
+        return self.unknowns.match(face_encoding, threshold)
+
+    def add_unknown(self, face_encoding, unknown_id):
+        """
+        Store a new unknown face encoding for future matching.
+        """
+        self.unknowns.add(face_encoding, unknown_id)
+
+
+def box_iou(a, b):
+    """
+    Intersection over union of two (top, right, bottom, left) boxes.
+    """
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+
+    if bottom <= top or right <= left:
+        return 0.0
+
+    inter = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
 
-        distances = np.linalg.norm(
-            np.array(self.unknown_encodings) - face_encoding,
-            axis=1
+
+def expand_box(box, padding, shape, min_size=0):
+    """
+    Grow a (top, right, bottom, left) box by `padding` times its size on
+    every side, to at least min_size pixels, clipped to a frame shape.
+    """
+    top, right, bottom, left = box
+    h, w = shape[:2]
+
+    pad_y = max((bottom - top) * padding, (min_size - (bottom - top)) / 2)
+    pad_x = max((right - left) * padding, (min_size - (right - left)) / 2)
+
+    return (
+        max(0, int(top - pad_y)),
+        min(w, int(right + pad_x)),
+        min(h, int(bottom + pad_y)),
+        max(0, int(left - pad_x))
+    )
+
+
+def merge_boxes(boxes):
+    """
+    Replace overlapping boxes by their common bounding box until
+    none overlap.
+    """
+    merged = list(boxes)
+
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                if (a[0] < b[2] and b[0] < a[2]
+                        and a[3] < b[1] and b[3] < a[1]):
+                    merged[i] = (
+                        min(a[0], b[0]), max(a[1], b[1]),
+                        max(a[2], b[2]), min(a[3], b[3])
+                    )
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+
+    return merged
+
+
+def _create_cv_tracker():
+    """
+    Build an OpenCV KCF tracker if this OpenCV build provides one.
+    """
+    for factory in ("TrackerKCF_create", "legacy.TrackerKCF_create"):
+        target = cv2
+        try:
+            for part in factory.split("."):
+                target = getattr(target, part)
+            return target()
+        except AttributeError:
+            continue
+    return None
+
+
+class FaceTrack:
+    """
+    A face followed across recognition passes.
+    """
+
+    __slots__ = (
+        "track_id", "box", "name", "distance", "margin", "velocity",
+        "last_detected", "last_encoded", "misses", "cv_tracker",
+        "display_box"
+    )
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.name = None
+        self.distance = None
+        self.margin = None
+        self.velocity = (0.0, 0.0, 0.0, 0.0)
+        self.last_detected = now
+        self.last_encoded = None
+        self.misses = 0
+        self.cv_tracker = None
+        self.display_box = box
+
+
+class FaceTrackManager:
+    """
+    Carries face identities across frames so stable faces
+    don't need a fresh 128-d encoding on every recognition pass.
+
+    Detections are associated to tracks by box overlap (IoU). Between
+    recognitions, boxes are moved for display either by OpenCV KCF
+    trackers or by extrapolating each track's recent motion.
+    """
+
+    # Longest time a box is extrapolated from its last detection
+    MAX_EXTRAPOLATION_SECONDS = 1.0
+
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD,
+                 max_misses=TRACK_MAX_MISSES,
+                 reencode_seconds=TRACK_REENCODE_SECONDS,
+                 min_margin=TRACK_MIN_MARGIN,
+                 use_cv_tracker=TRACK_USE_OPENCV):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.reencode_seconds = reencode_seconds
+        self.min_margin = min_margin
+        self.use_cv_tracker = use_cv_tracker
+
+        self.tracks = {}
+        self._next_id = 0
+
+        # Recognition updates tracks while the display thread reads them
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def _predicted_box(self, track, now):
+        dt = min(now - track.last_detected, self.MAX_EXTRAPOLATION_SECONDS)
+        return tuple(
+            int(v + dv * dt) for v, dv in zip(track.box, track.velocity)
         )
 
-        min_dist = min(distances)
+    def associate(self, boxes, now=None):
+        """
+        Greedily pair detected boxes with tracks by IoU.
+        Returns the matching track ID (or None) for each box.
+        """
+        now = time.monotonic() if now is None else now
+        assigned = [None] * len(boxes)
 
-        if min_dist < threshold:
-            return self.unknown_ids[distances.argmin()]
+        with self.lock:
+            tracks = list(self.tracks.values())
+            predicted = [self._predicted_box(t, now) for t in tracks]
 
-        return None
+        pairs = []
+        for i, box in enumerate(boxes):
+            for track, guess in zip(tracks, predicted):
+                iou = box_iou(box, guess)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, i, track.track_id))
 
-    def add_unknown(self, face_encoding, unknown_id):
+        used = set()
+        for _, i, track_id in sorted(pairs, reverse=True):
+            if assigned[i] is None and track_id not in used:
+                assigned[i] = track_id
+                used.add(track_id)
+
+        return assigned
+
+    def needs_encoding(self, track_id, now=None):
         """
-        Store a new unknown face encoding for future matching.
+        Whether a tracked face should be encoded again on this pass.
         """
-        self.unknown_encodings.append(face_encoding)
-        self.unknown_ids.append(unknown_id)
+        now = time.monotonic() if now is None else now
+        track = self.tracks.get(track_id)
+
+        if track is None or track.name is None or track.last_encoded is None:
+            return True
+        if now - track.last_encoded >= self.reencode_seconds:
+            return True
+        if track.margin is not None and track.margin < self.min_margin:
+            return True
+        return False
+
+    def boxes(self, now=None):
+        """
+        Where every track's face is expected to be now.
+        """
+        now = time.monotonic() if now is None else now
+
+        with self.lock:
+            return [
+                self._predicted_box(track, now)
+                for track in self.tracks.values()
+            ]
+
+    def stable_boxes(self, now=None):
+        """
+        Current boxes of tracks that don't need encoding on the next pass.
+        """
+        now = time.monotonic() if now is None else now
+
+        with self.lock:
+            return [
+                self._predicted_box(track, now)
+                for track_id, track in self.tracks.items()
+                if not self.needs_encoding(track_id, now)
+            ]
+
+    def identity(self, track_id):
+        track = self.tracks.get(track_id)
+        return track.name if track else None
+
+    def update(self, frame, detections, now=None):
+        """
+        Apply one recognition pass.
+
+        detections holds (track_id or None, box, match) per face, where
+        match is (name, distance, margin) for freshly encoded faces and
+        None for faces that kept their track's identity.
+        Returns the track ID of each detection.
+        """
+        now = time.monotonic() if now is None else now
+        track_ids = []
+
+        with self.lock:
+            for track_id, box, match in detections:
+                track = self.tracks.get(track_id)
+
+                if track is None:
+                    track = FaceTrack(self._next_id, box, now)
+                    self.tracks[track.track_id] = track
+                    self._next_id += 1
+                else:
+                    dt = now - track.last_detected
+                    if dt > 0:
+                        track.velocity = tuple(
+                            0.5 * old + 0.5 * (new - prev) / dt
+                            for old, new, prev
+                            in zip(track.velocity, box, track.box)
+                        )
+                    track.box = box
+                    track.last_detected = now
+                    track.misses = 0
+
+                if match is not None:
+                    track.name, track.distance, track.margin = match
+                    track.last_encoded = now
+
+                track.display_box = box
+                if self.use_cv_tracker and frame is not None:
+                    self._start_cv_tracker(track, frame)
+
+                track_ids.append(track.track_id)
+
+            # Tracks without a detection this pass
+            seen = set(track_ids)
+            for track_id in list(self.tracks):
+                if track_id in seen:
+                    continue
+                track = self.tracks[track_id]
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    del self.tracks[track_id]
+
+        return track_ids
+
+    def _start_cv_tracker(self, track, frame):
+        top, right, bottom, left = track.box
+        track.cv_tracker = _create_cv_tracker()
+        if track.cv_tracker is None:
+            # Not available in this OpenCV build
+            self.use_cv_tracker = False
+            return
+        track.cv_tracker.init(frame, (left, top, right - left, bottom - top))
+
+    def predict(self, frame=None, now=None):
+        """
+        Move every track's box to the current frame for display.
+        Returns a list of (name, box).
+        """
+        now = time.monotonic() if now is None else now
+        results = []
+
+        with self.lock:
+            for track in self.tracks.values():
+                if track.name is None:
+                    continue
+
+                if track.cv_tracker is not None and frame is not None:
+                    ok, (x, y, w, h) = track.cv_tracker.update(frame)
+                    if ok:
+                        track.display_box = (
+                            int(y), int(x + w), int(y + h), int(x)
+                        )
+                else:
+                    track.display_box = self._predicted_box(track, now)
+
+                results.append((track.name, track.display_box))
+
+        return results